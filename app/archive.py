@@ -0,0 +1,180 @@
+import json
+import os
+import shutil
+from typing import Iterable
+from urllib.parse import urlsplit
+
+import aioboto3
+import zstandard
+from botocore.config import Config
+
+from app.profiling import run_in_thread
+
+# Local directory or s3://bucket/prefix on R2. A local directory must be
+# reachable at the same path from every API worker
+ARCHIVE_URL = os.getenv("ARCHIVE_URL", "archive")
+
+R2_ACCOUNT_ID = os.getenv("R2_ACCOUNT_ID")
+R2_ACCESS_KEY = os.getenv("R2_ACCESS_KEY")
+R2_SECRET_KEY = os.getenv("R2_SECRET_KEY")
+
+ARCHIVE_CODEC = "zstd"
+ZSTD_LEVEL = 10
+# Rows per independently compressed frame, pages are read frame by frame
+ARCHIVE_FRAME_ROWS = 1000
+
+
+def archive_location(query_id: int) -> str:
+    base = ARCHIVE_URL.rstrip("/")
+    if urlsplit(base).scheme != "s3":
+        # Stored in query_archives and read back by API workers, which need not
+        # share the archiver's working directory
+        base = os.path.abspath(base)
+    return f"{base}/query_{query_id}.ndjson.zst"
+
+
+def write_archive_file(path: str, rows: Iterable[dict]) -> tuple[int, list[dict]]:
+    """Writes rows as zstd-compressed NDJSON, one frame per ARCHIVE_FRAME_ROWS
+
+    Returns how many rows were written and the frame index: each frame's byte
+    offset and length, how many results it holds and the cursor of its last
+    result, so a page can be read without decompressing what comes before it.
+    """
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    count = 0
+    frames = []
+    with open(path, "wb") as f:
+        for batch in _batches(rows, ARCHIVE_FRAME_ROWS):
+            frame = compressor.compress(
+                b"".join(json.dumps(row, default=str).encode() + b"\n" for row in batch)
+            )
+            results = [row for row in batch if is_result_row(row)]
+            frames.append(
+                {
+                    "offset": f.tell(),
+                    "length": len(frame),
+                    "results": len(results),
+                    "last_cursor": row_cursor(results[-1]) if results else None,
+                }
+            )
+            f.write(frame)
+            count += len(batch)
+    return count, frames
+
+
+def _batches(rows: Iterable[dict], size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _r2_client():
+    return aioboto3.Session().client(
+        "s3",
+        endpoint_url=f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com",
+        aws_access_key_id=R2_ACCESS_KEY,
+        aws_secret_access_key=R2_SECRET_KEY,
+        config=Config(retries=dict(max_attempts=3)),
+    )
+
+
+async def upload_archive(path: str, location: str):
+    """Moves a finished archive file to its final location"""
+    url = urlsplit(location)
+    if url.scheme == "s3":
+        async with _r2_client() as s3_client:
+            await s3_client.upload_file(path, url.netloc, url.path.lstrip("/"))
+        os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(location) or ".", exist_ok=True)
+        # mkstemp files are 0600 and keep that mode when moved, API workers
+        # may run as another user
+        os.chmod(path, 0o644)
+        shutil.move(path, location)
+
+
+async def remove_archive(location: str):
+    """Deletes an archive, once its query is deleted"""
+    url = urlsplit(location)
+    if url.scheme == "s3":
+        async with _r2_client() as s3_client:
+            await s3_client.delete_object(Bucket=url.netloc, Key=url.path.lstrip("/"))
+        return
+
+    try:
+        await run_in_thread(os.remove, location)
+    except FileNotFoundError:
+        pass
+
+
+async def read_archive_range(location: str, offset: int, length: int) -> bytes:
+    """Reads part of an archive, a ranged GET on R2"""
+    url = urlsplit(location)
+    if url.scheme == "s3":
+        async with _r2_client() as s3_client:
+            response = await s3_client.get_object(
+                Bucket=url.netloc,
+                Key=url.path.lstrip("/"),
+                Range=f"bytes={offset}-{offset + length - 1}",
+            )
+            async with response["Body"] as body:
+                return await body.read()
+
+    def read() -> bytes:
+        with open(location, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    return await run_in_thread(read)
+
+
+async def get_archived_query_results(
+    location: str,
+    frames: list[dict],
+    page: int = 1,
+    page_size: int = 1000,
+    after: int = None,
+) -> tuple[list[dict], bool]:
+    """Reads one page of processed results from an archive, like get_query_results
+
+    Returns (rows, has_more). Only the frames holding the page are fetched,
+    found through the archive's frame index.
+    """
+    skip = 0 if after is not None else (page - 1) * page_size
+    results = []
+    for frame in frames:
+        if not frame["results"]:
+            continue
+        if after is not None and frame["last_cursor"] <= after:
+            continue
+        if skip >= frame["results"]:
+            skip -= frame["results"]
+            continue
+
+        data = await read_archive_range(location, frame["offset"], frame["length"])
+        for line in zstandard.ZstdDecompressor().decompress(data).splitlines():
+            row = json.loads(line)
+            if not is_result_row(row):
+                continue
+            if after is not None and row_cursor(row) <= after:
+                continue
+            if skip:
+                skip -= 1
+                continue
+            results.append(row)
+        if len(results) > page_size:
+            break
+    return results[:page_size], len(results) > page_size
+
+
+def is_result_row(row: dict) -> bool:
+    return row["status"] == "processed" and row["result"] is not None
+
+
+def row_cursor(row: dict) -> int:
+    return row["completed_seq"]
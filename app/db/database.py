@@ -1,24 +1,151 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func, insert, select, text, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
 from fastapi import HTTPException
 import os
+import time
 from datetime import datetime, timezone
+from typing import Optional
 
-from app.models import Dataset, Query, QueryResult
-from app.models.service import QueryJobResult
+from app.db.summary import (
+    FACET_ERROR_CODE,
+    FACET_HOST,
+    QUERY_PROGRESS_COLUMNS,
+    query_facets_upsert,
+    query_progress,
+    query_summary_upsert,
+)
+from app.events import query_event
+from app.metrics import (
+    DB_POOL_CHECKOUT_WAIT,
+    DB_READ_SESSIONS,
+    DB_REPLICA_LAG,
+    RESULT_CALLBACKS,
+)
+from app.profiling import install_sql_tracing
+from app.models import (
+    Dataset,
+    Query,
+    QueryArchive,
+    QueryFacetCount,
+    QueryJob,
+    QueryResult,
+    QueryResultEntry,
+    QuerySummary,
+)
+from app.models.service import QueryJobResultPayload, QuerySample
 
-# Create engine and session factory
-engine = create_engine(os.environ["POSTGRES_URL"])
-SessionLocal = sessionmaker(bind=engine)
+# Pools are per process, so each server worker may open up to
+# DB_POOL_SIZE + DB_MAX_OVERFLOW connections of each engine
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Optional streaming replica for read-only routes, see get_read_db_session.
+# A local one for testing: pg_basebackup -D replica -R -X stream, then start
+# it on another port and point POSTGRES_REPLICA_URL at it
+POSTGRES_REPLICA_URL = os.getenv("POSTGRES_REPLICA_URL")
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", "2"))
+
+# Engines are created on first use rather than at import, so a process
+# forked from a parent that imported this module gets its own pool
+engine = None
+async_engine = None
+replica_engine = None
+SessionLocal = sessionmaker()
+ReplicaSessionLocal = sessionmaker()
+AsyncSessionLocal = async_sessionmaker(expire_on_commit=False)
+
+
+def _pool_options() -> dict:
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def init_engines():
+    """Creates the connection pools of this process, a no-op once created"""
+    global engine, async_engine, replica_engine
+    if engine is not None:
+        return
+
+    engine = create_engine(os.environ["POSTGRES_URL"], **_pool_options())
+    install_sql_tracing(engine)
+    SessionLocal.configure(bind=engine)
+
+    # Async engine for the publisher, same database through asyncpg
+    async_engine = create_async_engine(
+        make_url(os.environ["POSTGRES_URL"]).set(drivername="postgresql+asyncpg"),
+        **_pool_options(),
+    )
+    install_sql_tracing(async_engine.sync_engine)
+    AsyncSessionLocal.configure(bind=async_engine)
+
+    if POSTGRES_REPLICA_URL:
+        # A replica that is down should cost a quick fallback, not a hung request
+        replica_engine = create_engine(
+            POSTGRES_REPLICA_URL,
+            connect_args={"connect_timeout": REPLICA_CONNECT_TIMEOUT},
+            **_pool_options(),
+        )
+        install_sql_tracing(replica_engine)
+        ReplicaSessionLocal.configure(bind=replica_engine)
+
+
+async def dispose_engines():
+    """Closes the pooled connections of this process, on shutdown"""
+    global engine, async_engine, replica_engine
+    if engine is None:
+        return
+    await async_engine.dispose()
+    engine.dispose()
+    if replica_engine is not None:
+        replica_engine.dispose()
+    engine = async_engine = replica_engine = None
+
+
+def _forget_engines_after_fork():
+    # Connections inherited from the parent belong to it, drop them without
+    # closing so the parent's sockets stay intact
+    global engine, async_engine, replica_engine
+    if engine is None:
+        return
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+    if replica_engine is not None:
+        replica_engine.dispose(close=False)
+    engine = async_engine = replica_engine = None
+
+
+os.register_at_fork(after_in_child=_forget_engines_after_fork)
+
+# Tables partitioned by query_id, see migrations/003_partition_query_results.sql
+PARTITIONED_TABLES = ["query_results", "query_result_entries"]
 
 
 @contextmanager
 def get_db_session():
+    init_engines()
     session = SessionLocal()
     try:
+        started = time.perf_counter()
+        session.connection()
+        DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+
         yield session
         session.commit()
+    except HTTPException:
+        session.rollback()
+        raise
     except Exception as e:
         session.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -26,6 +153,117 @@ def get_db_session():
         session.close()
 
 
+def replica_lag(session: Session) -> float:
+    """Seconds the replica is behind, 0 when it replayed all WAL it received
+
+    Having replayed everything it received only counts while the WAL receiver
+    is streaming. Once it disconnected the replica falls further behind with
+    nothing to replay, so the lag is the age of the last replayed transaction.
+    pg_stat_wal_receiver only shows the status to pg_read_all_stats members,
+    without it a running receiver counts as streaming.
+    """
+    return session.execute(
+        text(
+            """
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN NOT EXISTS (
+                    SELECT FROM pg_stat_wal_receiver
+                    WHERE coalesce(status, 'streaming') = 'streaming'
+                ) THEN extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+            END
+            """
+        )
+    ).scalar()
+
+
+def _replica_route(session: Session, query_id: int, settled: bool) -> str:
+    """Returns why the replica cannot serve the read, or None when it can"""
+    lag = replica_lag(session)
+    if lag is None:
+        # Nothing replayed yet since the replica started
+        return "lagging"
+    DB_REPLICA_LAG.set(lag)
+    if lag > REPLICA_MAX_LAG_SECONDS:
+        return "lagging"
+    if query_id is None:
+        return None
+
+    row = (
+        session.query(Query.status, QuerySummary)
+        .outerjoin(QuerySummary, QuerySummary.query_id == Query.id)
+        .filter(Query.id == query_id)
+        .first()
+    )
+    if row is None:
+        # Registered too recently to have replicated
+        return "not_found"
+    status, summary = row
+    if not settled or status == "archived":
+        return None
+    # Results of unfinished queries and of ones that finished within the lag
+    # are still moving, and their event stream cursors come from the primary
+    if (
+        status not in ("published", "processed")
+        or summary is None
+        or summary.processed + summary.errored < summary.published
+    ):
+        return "unsettled"
+    return None
+
+
+@contextmanager
+def get_read_db_session(query_id: int = None, settled: bool = False):
+    """Session for read-only routes, on the replica when it can serve the read
+
+    Falls back to the primary when no replica is configured, it is unreachable
+    or more than REPLICA_MAX_LAG_SECONDS behind, it has not seen `query_id`
+    yet, or `settled` is asked for and the query's results are still being
+    written as far as the replica knows.
+    """
+    init_engines()
+    reason = "no_replica"
+    if replica_engine is not None:
+        session = ReplicaSessionLocal()
+        try:
+            try:
+                reason = _replica_route(session, query_id, settled)
+            except OperationalError:
+                reason = "unavailable"
+
+            if reason is None:
+                DB_READ_SESSIONS.labels(target="replica", reason="fresh").inc()
+                yield session
+                return
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+        finally:
+            session.close()
+
+    DB_READ_SESSIONS.labels(target="primary", reason=reason).inc()
+    with get_db_session() as session:
+        yield session
+
+
+@asynccontextmanager
+async def get_async_db_session():
+    init_engines()
+    async with AsyncSessionLocal() as session:
+        try:
+            yield session
+            await session.commit()
+        except HTTPException:
+            await session.rollback()
+            raise
+        except Exception as e:
+            await session.rollback()
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+
 def save_new_query(
     session: Session,
     dataset: str,
@@ -34,20 +272,180 @@ def save_new_query(
     model: str,
     owner: str,
     status: str = "pending",
+    sample: QuerySample = None,
+    match_target: int = None,
 ) -> int:
+    # Partitions first, so this transaction holds no lock on queries while
+    # they are attached, see create_query_partitions
+    query_id = session.execute(text("SELECT nextval('queries_id_seq')")).scalar()
+    create_query_partitions(query_id)
+
     query_obj = Query(
+        id=query_id,
         dataset=dataset,
         language=language,
         query_text=query_text,
         model=model,
         owner=owner,
         status=status,
+        match_target=match_target,
     )
+    if sample is not None:
+        query_obj.sample_fraction = sample.fraction
+        query_obj.sample_shards = sample.shards
+        query_obj.sample_bytes = sample.max_bytes
+        query_obj.sample_seed = sample.seed
     session.add(query_obj)
-    session.flush()  # To get the ID
+    session.flush()
     return query_obj.id
 
 
+PARTITION_LOCK_TIMEOUT = "2s"
+PARTITION_ATTEMPTS = 5
+QUERY_JOBS_PRUNE_BATCH = int(os.getenv("QUERY_JOBS_PRUNE_BATCH", "5000"))
+
+
+def create_query_partitions(query_id: int):
+    """Creates and attaches the partitions of a query in their own transaction
+
+    Attaching clones the foreign key to queries, which takes a SHARE ROW
+    EXCLUSIVE lock on it and so waits for every open transaction that wrote to
+    queries. The lock timeout turns a wait on a transaction stuck behind this
+    one, such as a publisher sharing the event loop, into a retry.
+    """
+    init_engines()
+    for attempt in range(1, PARTITION_ATTEMPTS + 1):
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+                conn.execute(
+                    text("SELECT create_query_partitions(:query_id)"),
+                    {"query_id": query_id},
+                )
+            return
+        except OperationalError:
+            if attempt == PARTITION_ATTEMPTS:
+                raise
+            time.sleep(0.1 * attempt)
+
+
+def drop_query_partitions(query_id: int):
+    """Detaches and drops the partitions holding a query's results
+
+    Runs outside of a transaction so the detach can be CONCURRENTLY, which does
+    not block reads and writes of other queries. The detach waits for every
+    transaction using the partition, including ones held by a publisher on
+    the caller's event loop, so call it from a thread. A lock timeout turns
+    such a wait into a retry, which finalizes the interrupted detach.
+    """
+    init_engines()
+    for attempt in range(1, PARTITION_ATTEMPTS + 1):
+        try:
+            _drop_query_partitions(query_id)
+            return
+        except OperationalError:
+            if attempt == PARTITION_ATTEMPTS:
+                raise
+            time.sleep(0.1 * attempt)
+
+
+def _drop_query_partitions(query_id: int):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # Session level, reset before the connection goes back to the pool
+        conn.execute(text(f"SET lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+        try:
+            for parent in PARTITIONED_TABLES:
+                partition = f"{parent}_q{int(query_id)}"
+                detach_pending = conn.execute(
+                    text(
+                        "SELECT inhdetachpending FROM pg_inherits"
+                        " WHERE inhrelid = to_regclass(:partition)"
+                    ),
+                    {"partition": partition},
+                ).scalar()
+
+                if detach_pending is True:
+                    # An earlier concurrent detach was interrupted
+                    conn.execute(
+                        text(f"ALTER TABLE {parent} DETACH PARTITION {partition} FINALIZE")
+                    )
+                elif detach_pending is False:
+                    conn.execute(
+                        text(
+                            f"ALTER TABLE {parent} DETACH PARTITION {partition} CONCURRENTLY"
+                        )
+                    )
+                conn.execute(text(f"DROP TABLE IF EXISTS {partition}"))
+        finally:
+            conn.execute(text("RESET lock_timeout"))
+
+
+def delete_query(session: Session, query_id: int):
+    """Deletes a query whose partitions were dropped with drop_query_partitions
+
+    Its query_jobs rows are left for prune_query_jobs.
+    """
+    session.query(Query).filter(Query.id == query_id).delete(synchronize_session=False)
+
+
+def prune_query_jobs(query_id: int, batch_size: int = QUERY_JOBS_PRUNE_BATCH) -> int:
+    """Deletes the job routes of a deleted or archived query in short batches
+
+    Returns how many were deleted.
+    """
+    init_engines()
+    pruned = 0
+    while True:
+        with engine.begin() as conn:
+            deleted = conn.execute(
+                text(
+                    """
+                    DELETE FROM query_jobs
+                    WHERE job_id IN (
+                        SELECT job_id FROM query_jobs
+                        WHERE query_id = :query_id
+                        LIMIT :batch_size
+                    )
+                    """
+                ),
+                {"query_id": query_id, "batch_size": batch_size},
+            ).rowcount
+        pruned += deleted
+        if deleted < batch_size:
+            return pruned
+
+
+def get_prunable_job_queries(session: Session) -> list[int]:
+    """Ids in query_jobs whose query was deleted or archived
+
+    Walks the distinct query ids through the query_id index, one probe each,
+    rather than scanning every job.
+    """
+    rows = session.execute(
+        text(
+            """
+            WITH RECURSIVE ids AS (
+                (SELECT query_id FROM query_jobs ORDER BY query_id LIMIT 1)
+                UNION ALL
+                SELECT (
+                    SELECT query_id FROM query_jobs
+                    WHERE query_id > ids.query_id
+                    ORDER BY query_id LIMIT 1
+                )
+                FROM ids
+                WHERE ids.query_id IS NOT NULL
+            )
+            SELECT ids.query_id
+            FROM ids
+            LEFT JOIN queries q ON q.id = ids.query_id
+            WHERE ids.query_id IS NOT NULL
+              AND (q.id IS NULL OR q.status = 'archived')
+            """
+        )
+    ).all()
+    return [row.query_id for row in rows]
+
+
 def add_query_result(
     session: Session,
     query_id: int,
@@ -61,35 +459,153 @@ def add_query_result(
         status="pending",
     )
     session.add(query_result)
+    session.add(QueryJob(job_id=job_id, query_id=query_id))
     session.flush()
     return query_result.id
 
 
 def save_query_result(
     session: Session,
-    result: QueryJobResult,
+    result: QueryJobResultPayload,
 ) -> int:
-    query_result = (
-        session.query(QueryResult).filter(QueryResult.job_id == result.job_id).first()
-    )
+    """Stores a callback decoded by app.wire.decode_job_result"""
+    job_id = result["jobId"]
+    # Resolve the query first so the lookup only touches its partition
+    job = session.execute(
+        select(QueryJob.query_id, Query.match_target, Query.status)
+        .join(Query, Query.id == QueryJob.query_id)
+        .where(QueryJob.job_id == job_id)
+    ).first()
+    query_result = None
+    if job and job.status != "archived":
+        query_result = (
+            session.query(QueryResult)
+            .filter(
+                QueryResult.query_id == job.query_id,
+                QueryResult.job_id == job_id,
+            )
+            # Concurrent deliveries of a job wait here, so only one completes it
+            .with_for_update()
+            .first()
+        )
 
-    if query_result:
-        # Update existing record
-        query_result.result = result.batch_classify_result or result.error_result
-        query_result.finished_at = datetime.now(timezone.utc)
-        query_result.status = "error" if result.error_result else "processed"
-    else:
+    if not query_result:
+        RESULT_CALLBACKS.labels(outcome="not_found").inc()
         raise HTTPException(status_code=404, detail="QueryResult not found")
 
-    # Update the query's total_processed
-    query = session.query(Query).filter(Query.id == query_result.query_id).first()
-    if query:
-        query.total_processed += 1
+    if query_result.status == "processed":
+        # A processed result is final: the summary, facets and search entries
+        # already count it, so a redelivery must not replace it
+        RESULT_CALLBACKS.labels(outcome="duplicate").inc()
+        return query_result.id
+
+    first_completion = query_result.status == "pending"
+    # A job that errored may still be retried, its error is taken back
+    previous_error = query_result.result if query_result.status == "error" else None
+
+    # Update existing record
+    if result.get("errorResult"):
+        query_result.result = result["errorResult"]
+        query_result.status = "error"
+    else:
+        query_result.result = result.get("batchClassifyResult", [])
+        query_result.status = "processed"
+    query_result.finished_at = datetime.now(timezone.utc)
+    processed = query_result.status == "processed"
+
+    RESULT_CALLBACKS.labels(
+        outcome=query_result.status if first_completion or processed else "duplicate"
+    ).inc()
+
+    # Only a job's first completion, and an error turning processed, count
+    # towards progress and summaries
+    deltas = {}
+    if processed:
+        deltas = {"processed": 1, "matches": len(query_result.result)}
+        if previous_error is not None:
+            deltas["errored"] = -1
+    elif first_completion:
+        deltas = {"errored": 1}
+
+    # Index the entries and count the facets first: the summary row taken
+    # next serializes every callback of the query until commit, so only the
+    # sequence upsert and the result's own update, flushed last, run under it.
+    # A job that completes, or turns processed on a retry, takes the query's
+    # next completion sequence number. Being taken under that lock, results
+    # appear in sequence order and a cursor never skips a job that finished late.
+    progress = None
+    with session.no_autoflush:
+        if processed:
+            save_query_result_entries(session, query_result)
+        facets = query_facets_upsert(
+            query_result.query_id,
+            query_result.result if processed else [],
+            None if processed else query_result.result,
+            replaced_error=previous_error,
+        )
+        if facets is not None:
+            session.execute(facets)
+
+        if first_completion or processed:
+            progress = query_progress(
+                session.execute(
+                    query_summary_upsert(query_result.query_id, complete=True, **deltas)
+                    .returning(*QUERY_PROGRESS_COLUMNS)
+                ).one()
+            )
+            query_result.completed_seq = progress["cursor"]
+
+            # The query may have been archived while this callback waited for
+            # the summary row, its partitions are about to be dropped
+            status = session.execute(
+                select(Query.status).where(Query.id == job.query_id)
+            ).scalar()
+            if status == "archived":
+                raise HTTPException(status_code=404, detail="QueryResult not found")
 
     session.flush()
+
+    if progress is not None:
+        # The totals as of this commit, read under the summary row lock
+        query_event(session, query_result.query_id, **progress)
+
+    if (
+        processed
+        and job.match_target is not None
+        and query_result.result
+        and progress["matches"] >= job.match_target
+    ):
+        complete_query_at_target(session, query_result.query_id)
+
     return query_result.id
 
 
+def complete_query_at_target(session: Session, query_id: int):
+    """Marks a query done once it reached its match target, publishing stops"""
+    done = session.execute(
+        update(Query)
+        .where(Query.id == query_id, Query.status.in_(["publishing", "published"]))
+        .values(status="processed")
+    ).rowcount
+    if done:
+        query_event(session, query_id, status="processed")
+
+
+def save_query_result_entries(session: Session, query_result: QueryResult):
+    """Extracts a processed job's entries into the search index"""
+    entries = [
+        {
+            "query_id": query_result.query_id,
+            "result_id": query_result.id,
+            "uri": entry.get("uri") or "",
+            "text": entry.get("text") or "",
+        }
+        for entry in query_result.result
+    ]
+    if entries:
+        session.execute(insert(QueryResultEntry), entries)
+
+
 def save_data_record(
     session: Session,
     name: str,
@@ -119,24 +635,215 @@ def save_data_record(
 
 
 def get_query_results(
-    session: Session, query_id: int, page: int = 1, page_size: int = 1000
-) -> tuple[list, int]:
+    session: Session,
+    query_id: int,
+    page: int = 1,
+    page_size: int = 1000,
+    after: int = None,
+) -> tuple[list, int, bool]:
+    """Returns (results, total, has_more), results in completion order"""
     # Get total count
     total = session.query(QueryResult).filter(QueryResult.query_id == query_id).count()
 
     # Get paginated results
-    results = (
+    stmt = (
         session.query(QueryResult)
         .filter(QueryResult.query_id == query_id)
         .filter(QueryResult.status == "processed")
         .filter(QueryResult.result.isnot(None))
-        .order_by(QueryResult.id)
-        .offset((page - 1) * page_size)
-        .limit(page_size)
+        .filter(QueryResult.completed_seq.isnot(None))
+        .order_by(QueryResult.completed_seq)
+    )
+    if after is not None:
+        # Cursor pagination, cursors are completion sequence numbers from the
+        # event stream or a previous page's next_cursor
+        stmt = stmt.filter(QueryResult.completed_seq > after)
+    else:
+        stmt = stmt.offset((page - 1) * page_size)
+    results = stmt.limit(page_size + 1).all()
+
+    return results[:page_size], total, len(results) > page_size
+
+
+def has_query_results(session: Session, query_id: int) -> bool:
+    """Whether any job of the query was published yet
+
+    Keep the query_id predicate on query_results itself: under an OR, or
+    correlated through Query.results.any(), Postgres cannot prune the scan to
+    the query's partition and locks every partition instead.
+    """
+    return session.query(
+        session.query(QueryResult.id).filter(QueryResult.query_id == query_id).exists()
+    ).scalar()
+
+
+def get_query_progress(session: Session, query_id: int) -> dict:
+    summary = session.get(QuerySummary, query_id)
+    if summary is None:
+        summary = QuerySummary(published=0, processed=0, errored=0, matches=0, version=0)
+
+    return {"query_id": query_id, **query_progress(summary)}
+
+
+def get_top_facet_counts(
+    session: Session, query_id: int, facet: str, limit: int = 10
+) -> list[QueryFacetCount]:
+    return (
+        session.query(QueryFacetCount)
+        .filter(
+            QueryFacetCount.query_id == query_id,
+            QueryFacetCount.facet == facet,
+            # Error codes a retry took back stay behind at zero
+            QueryFacetCount.count > 0,
+        )
+        .order_by(QueryFacetCount.count.desc(), QueryFacetCount.value)
+        .limit(limit)
+        .all()
+    )
+
+
+def get_query_summary(session: Session, query_id: int, top: int = 10) -> dict:
+    summary = get_query_progress(session, query_id)
+    summary.update(
+        error_codes=get_top_facet_counts(session, query_id, FACET_ERROR_CODE, top),
+        top_hosts=get_top_facet_counts(session, query_id, FACET_HOST, top),
+    )
+    return summary
+
+
+def search_query_results(
+    session: Session,
+    query_id: int,
+    q: str,
+    mode: str = "text",
+    after: int = None,
+    limit: int = 100,
+) -> tuple[list[QueryResultEntry], bool]:
+    stmt = session.query(QueryResultEntry).filter(QueryResultEntry.query_id == query_id)
+    if mode == "uri":
+        # Substring match, served by the trigram index on uri
+        stmt = stmt.filter(QueryResultEntry.uri.icontains(q, autoescape=True))
+    else:
+        stmt = stmt.filter(
+            QueryResultEntry.search_vector.op("@@")(
+                func.websearch_to_tsquery("simple", q)
+            )
+        )
+    if after is not None:
+        stmt = stmt.filter(QueryResultEntry.id > after)
+
+    hits = stmt.order_by(QueryResultEntry.id).limit(limit + 1).all()
+    return hits[:limit], len(hits) > limit
+
+
+def get_query_archive(session: Session, query_id: int) -> QueryArchive:
+    return session.get(QueryArchive, query_id)
+
+
+def get_archivable_queries(
+    session: Session, finished_before: datetime, limit: int = 100
+) -> list[int]:
+    """Ids of queries whose jobs all finished before the given time"""
+    rows = (
+        _archivable_queries(session, finished_before)
+        .order_by(Query.id)
+        .limit(limit)
         .all()
     )
+    return [row.id for row in rows]
+
+
+def get_archive_version(
+    session: Session, query_id: int, finished_before: datetime
+) -> Optional[int]:
+    """Summary version of a query that may be archived, None if it may not
+
+    Read before exporting the query, save_query_archive checks it did not move.
+    """
+    row = (
+        _archivable_queries(session, finished_before)
+        .filter(Query.id == query_id)
+        .first()
+    )
+    return row.version if row else None
+
+
+def _archivable_queries(session: Session, finished_before: datetime):
+    return (
+        session.query(Query.id, QuerySummary.version)
+        .join(QuerySummary, QuerySummary.query_id == Query.id)
+        .filter(
+            Query.status.in_(["published", "processed"]),
+            QuerySummary.published > 0,
+            QuerySummary.processed + QuerySummary.errored >= QuerySummary.published,
+            QuerySummary.updated_at < finished_before,
+        )
+    )
+
+
+def iter_query_result_rows(session: Session, query_id: int):
+    """Streams a query's results in completion order with a server-side cursor"""
+    results = (
+        session.query(QueryResult)
+        .filter(QueryResult.query_id == query_id)
+        .order_by(QueryResult.completed_seq.asc().nulls_last(), QueryResult.id)
+        .yield_per(1000)
+    )
+    for r in results:
+        yield {
+            "id": r.id,
+            "completed_seq": r.completed_seq,
+            "job_id": r.job_id,
+            "data_id": r.data_id,
+            "status": r.status,
+            "result": r.result,
+            "finished_at": r.finished_at,
+            "created_at": r.created_at,
+        }
+
 
-    return results, total
+def save_query_archive(
+    session: Session,
+    query_id: int,
+    version: int,
+    location: str,
+    codec: str,
+    jobs: int,
+    byte_size: int,
+    frames: list[dict],
+):
+    """Records an archive and switches the query over to being served from it
+
+    `version` is the query's summary version from before the export. Raises
+    ValueError if a callback changed the query since, e.g. a retry that turned
+    processed, the archive misses it.
+    """
+    # Callbacks take the summary row last, so this waits for those in
+    # progress, and those after see the query archived, see save_query_result
+    current = session.execute(
+        select(QuerySummary.version)
+        .where(QuerySummary.query_id == query_id)
+        .with_for_update()
+    ).scalar()
+    if current != version:
+        raise ValueError(f"Query {query_id} changed while it was archived")
+
+    session.add(
+        QueryArchive(
+            query_id=query_id,
+            location=location,
+            codec=codec,
+            jobs=jobs,
+            byte_size=byte_size,
+            frames=frames,
+        )
+    )
+    # Late callbacks for an archived query have nowhere to go, save_query_result
+    # turns them away until prune_query_jobs removes their routes
+    session.query(Query).filter(Query.id == query_id).update(
+        {Query.status: "archived"}, synchronize_session=False
+    )
+    session.flush()
 
 
 def get_query_status(session: Session, query_id: int) -> dict:
@@ -170,4 +877,4 @@ def get_query_detail(session: Session, query_id: int) -> Query:
 
 
 def get_owned_queries(session: Session, owner: str) -> list[dict]:
-    return session.query(Query).filter(Query.publisher == owner).all()
+    return session.query(Query).filter(Query.owner == owner).all()
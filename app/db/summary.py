@@ -0,0 +1,111 @@
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models import QueryFacetCount, QuerySummary
+
+FACET_ERROR_CODE = "error_code"
+FACET_HOST = "host"
+
+FACET_VALUE_MAX_LENGTH = 255
+
+
+# Read back from the summary upsert, see query_progress
+QUERY_PROGRESS_COLUMNS = (
+    QuerySummary.published,
+    QuerySummary.processed,
+    QuerySummary.errored,
+    QuerySummary.matches,
+    QuerySummary.last_cursor,
+    QuerySummary.version,
+)
+
+
+def query_summary_upsert(query_id: int, complete: bool = False, **deltas: int):
+    """Builds an upsert adding the given counter deltas to a query's summary row
+
+    With `complete`, also advances the query's completion sequence in
+    last_cursor, read it back with `.returning(QuerySummary.last_cursor)`.
+    Every update bumps the row's version.
+    """
+    stmt = insert(QuerySummary).values(
+        query_id=query_id,
+        last_cursor=1 if complete else None,
+        version=1,
+        updated_at=datetime.now(timezone.utc),
+        **deltas,
+    )
+    updates = {
+        name: getattr(QuerySummary, name) + stmt.excluded[name] for name in deltas
+    }
+    updates["version"] = QuerySummary.version + 1
+    updates["updated_at"] = stmt.excluded.updated_at
+    if complete:
+        updates["last_cursor"] = func.coalesce(QuerySummary.last_cursor, 0) + 1
+
+    return stmt.on_conflict_do_update(
+        index_elements=[QuerySummary.query_id], set_=updates
+    )
+
+
+def query_progress(summary) -> dict:
+    """Absolute progress of a query from its summary row, or a row returning
+    QUERY_PROGRESS_COLUMNS. Totals of a later version supersede earlier ones"""
+    return {
+        "published": summary.published,
+        "processed": summary.processed,
+        "errored": summary.errored,
+        "matches": summary.matches,
+        "cursor": summary.last_cursor,
+        "version": summary.version,
+    }
+
+
+def uri_host(uri: str) -> str:
+    """Host of a crawled URI, empty when it has none or does not parse"""
+    try:
+        return urlsplit(uri).hostname or ""
+    except ValueError:
+        # Crawled URIs can be malformed, e.g. unbalanced IPv6 brackets
+        return ""
+
+
+def query_facets_upsert(
+    query_id: int,
+    batch_classify_result: list[dict],
+    error_result: dict = None,
+    replaced_error: dict = None,
+):
+    """Builds an upsert adding one job's contribution to the query's facet counts
+
+    `replaced_error` is an error the job reported before, taken back now that a
+    retry replaced it. Returns None if the job's counts do not change.
+    """
+    counts = Counter()
+    if error_result is not None:
+        counts[(FACET_ERROR_CODE, str(error_result.get("code")))] += 1
+    if replaced_error is not None:
+        counts[(FACET_ERROR_CODE, str(replaced_error.get("code")))] -= 1
+    for entry in batch_classify_result:
+        host = uri_host(entry.get("uri") or "")
+        counts[(FACET_HOST, host[:FACET_VALUE_MAX_LENGTH])] += 1
+
+    rows = [
+        {"query_id": query_id, "facet": facet, "value": value, "count": count}
+        for (facet, value), count in sorted(counts.items())
+        if count
+    ]
+    if not rows:
+        return None
+
+    stmt = insert(QueryFacetCount).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[
+            QueryFacetCount.query_id,
+            QueryFacetCount.facet,
+            QueryFacetCount.value,
+        ],
+        set_={"count": QueryFacetCount.count + stmt.excluded.count},
+    )
@@ -0,0 +1,351 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from typing import AsyncGenerator, Callable
+
+import psycopg2
+import psycopg2.extensions
+from fastapi import Request
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from app.profiling import run_in_thread
+
+QUERY_EVENTS_CHANNEL = "query_events"
+SUBSCRIBER_QUEUE_SIZE = 256
+KEEPALIVE_SECONDS = 15.0
+RECONNECT_SECONDS = 1.0
+# Events committed in a worker are coalesced and sent this often
+QUERY_EVENT_FLUSH_SECONDS = float(os.getenv("QUERY_EVENT_FLUSH_SECONDS", "0.25"))
+
+PENDING_EVENTS = "pending_query_events"
+
+# Absolute totals of a query's summary row, see app.db.summary.query_progress.
+# Those of a higher version supersede the rest
+PROGRESS_FIELDS = ("published", "processed", "errored", "matches", "cursor", "version")
+
+# Sentinel pushed to subscribers that missed events and must re-read a snapshot
+RESYNC = {"type": "resync"}
+
+logger = logging.getLogger(__name__)
+
+
+def query_event(session: Session, query_id: int, **fields):
+    """Records a progress event for a query, sent once the session commits.
+
+    Progress is sent as the summary's absolute totals and version, read back
+    under its row lock, so a client can tell which events a snapshot already
+    covers. Sending NOTIFY from the callback transaction would serialize every
+    commit in the database on Postgres' notify queue lock, so events are
+    coalesced per worker and sent by QueryEventFlusher. Processes that run no
+    flusher, like a publisher started outside the API, still send them from
+    the committing transaction. Rolled back events are dropped.
+    """
+    session = getattr(session, "sync_session", session)
+    session.info.setdefault(PENDING_EVENTS, []).append({"query_id": query_id, **fields})
+
+
+@event.listens_for(Session, "before_commit")
+def _notify_without_flusher(session: Session):
+    if query_event_batcher.enabled:
+        return
+    events = session.info.pop(PENDING_EVENTS, None)
+    if not events:
+        return
+    merged: dict[int, dict] = {}
+    for pending in events:
+        merge_event(merged.setdefault(pending["query_id"], {}), pending)
+    session.execute(
+        text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+        {
+            "channel": QUERY_EVENTS_CHANNEL,
+            "payloads": [json.dumps(e) for e in merged.values()],
+        },
+    )
+
+
+@event.listens_for(Session, "after_commit")
+def _queue_committed_events(session: Session):
+    # Also fires when a savepoint is released, the outer transaction may still roll back
+    if session.in_nested_transaction():
+        return
+    events = session.info.pop(PENDING_EVENTS, None)
+    if events:
+        query_event_batcher.add(events)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _drop_uncommitted_events(session: Session, transaction):
+    if transaction.parent is None:
+        session.info.pop(PENDING_EVENTS, None)
+
+
+def merge_event(merged: dict, event: dict):
+    """Folds an event into a coalesced one: the totals of the higher version
+    win, whatever order commits were queued in, and anything else, like the
+    status, takes the latest value"""
+    stale = event.get("version", 0) < merged.get("version", 0)
+    for key, value in event.items():
+        if not (stale and key in PROGRESS_FIELDS):
+            merged[key] = value
+
+
+def unseen_event(event: dict, version: int) -> dict:
+    """Drops the totals of an event a client has seen at `version` or later,
+    e.g. a commit its snapshot read before the event was flushed"""
+    if event.get("version", version + 1) > version:
+        return event
+    return {key: value for key, value in event.items() if key not in PROGRESS_FIELDS}
+
+
+class QueryEventBatcher:
+    """Coalesces committed progress events per query until the next flush
+
+    Disabled in processes that run no flusher, their sessions send their own.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._pending: dict[int, dict] = {}
+        # Sessions commit on the event loop as well as in threads
+        self._lock = threading.Lock()
+
+    def add(self, events: list[dict]):
+        if not self.enabled:
+            return
+        with self._lock:
+            for pending in events:
+                merge_event(self._pending.setdefault(pending["query_id"], {}), pending)
+
+    def drain(self) -> list[dict]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return list(pending.values())
+
+
+class QueryEventFlusher:
+    """Sends the coalesced events of this worker as one NOTIFY transaction per interval"""
+
+    def __init__(self, database_url: str, batcher: QueryEventBatcher):
+        self._dsn = make_url(database_url).set(drivername="postgresql").render_as_string(
+            hide_password=False
+        )
+        self._batcher = batcher
+        self._conn = None
+        self._task = None
+        self._stopping = asyncio.Event()
+
+    async def start(self):
+        self._batcher.enabled = True
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            # Not cancelled: a flush in progress keeps using the connection
+            # from its thread, let it finish before the last one
+            self._stopping.set()
+            await self._task
+            self._task = None
+        # Whatever committed before shutdown still goes out
+        await self.flush()
+        self._batcher.enabled = False
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), QUERY_EVENT_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                await self.flush()
+
+    async def flush(self):
+        events = self._batcher.drain()
+        if not events:
+            return
+        try:
+            await asyncio.to_thread(self._notify, events)
+        except psycopg2.Error as e:
+            logger.error(f"Sending query events failed: {str(e)}")
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            # Retried with the next flush, merged with whatever came in since
+            self._batcher.add(events)
+
+    def _notify(self, events: list[dict]):
+        if self._conn is None:
+            self._conn = psycopg2.connect(self._dsn)
+            self._conn.set_isolation_level(
+                psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT
+            )
+        with self._conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload",
+                (QUERY_EVENTS_CHANNEL, [json.dumps(e) for e in events]),
+            )
+
+
+class QueryEventHub:
+    """In-process fan-out of query progress events to SSE subscribers"""
+
+    def __init__(self):
+        self._subscribers: dict[int, set[asyncio.Queue]] = defaultdict(set)
+
+    def subscribe(self, query_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers[query_id].add(queue)
+        return queue
+
+    def unsubscribe(self, query_id: int, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(query_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[query_id]
+
+    def publish(self, event: dict):
+        for queue in self._subscribers.get(event.get("query_id"), ()):
+            self._put(queue, event)
+
+    def resync_all(self):
+        """Tells every subscriber to re-read its snapshot, e.g. after a lost connection"""
+        for subscribers in self._subscribers.values():
+            for queue in subscribers:
+                self._put(queue, RESYNC)
+
+    @staticmethod
+    def _put(queue: asyncio.Queue, event: dict):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow consumer: drop the backlog, a fresh snapshot supersedes it
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESYNC)
+
+
+class QueryEventListener:
+    """Feeds the hub from Postgres LISTEN so every replica sees every callback"""
+
+    def __init__(self, database_url: str, hub: QueryEventHub):
+        self._dsn = make_url(database_url).set(drivername="postgresql").render_as_string(
+            hide_password=False
+        )
+        self._hub = hub
+        self._conn = None
+        self._reconnect_task = None
+
+    async def start(self):
+        # Connecting blocks until the database answers, which it may not while
+        # reconnecting, so keep it off the event loop
+        self._conn = await asyncio.to_thread(self._connect)
+        asyncio.get_running_loop().add_reader(self._conn.fileno(), self._on_readable)
+        logger.info(f"Listening for query events on channel {QUERY_EVENTS_CHANNEL}")
+
+    def _connect(self):
+        conn = psycopg2.connect(self._dsn)
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {QUERY_EVENTS_CHANNEL}")
+        except psycopg2.Error:
+            conn.close()
+            raise
+        return conn
+
+    async def stop(self):
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+        self._close()
+
+    def _close(self):
+        if self._conn is None:
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(self._conn.fileno())
+        except (ValueError, psycopg2.InterfaceError):
+            pass
+        self._conn.close()
+        self._conn = None
+
+    def _on_readable(self):
+        try:
+            self._conn.poll()
+        except psycopg2.Error as e:
+            logger.error(f"Query event listener lost its connection: {str(e)}")
+            self._close()
+            self._reconnect_task = asyncio.ensure_future(self._reconnect())
+            return
+
+        while self._conn.notifies:
+            notify = self._conn.notifies.pop(0)
+            try:
+                self._hub.publish(json.loads(notify.payload))
+            except ValueError:
+                logger.warning(f"Ignoring malformed query event: {notify.payload}")
+
+    async def _reconnect(self):
+        while True:
+            await asyncio.sleep(RECONNECT_SECONDS)
+            try:
+                await self.start()
+            except psycopg2.Error as e:
+                logger.error(f"Reconnecting query event listener failed: {str(e)}")
+                continue
+            # Events may have been missed while disconnected
+            self._hub.resync_all()
+            return
+
+
+query_event_hub = QueryEventHub()
+query_event_batcher = QueryEventBatcher()
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def stream_query_events(
+    request: Request, query_id: int, snapshot: Callable[[], dict]
+) -> AsyncGenerator[str, None]:
+    """Streams a progress snapshot followed by live progress for a query
+
+    Snapshots and progress events both carry the absolute totals and their
+    version. Events reach the stream up to a flush interval after their
+    commit, so those a snapshot already covers only pass on their status.
+    """
+    # Subscribe before reading the snapshot so no event falls in between
+    queue = query_event_hub.subscribe(query_id)
+    try:
+        # snapshot() queries the database, keep it off the event loop
+        progress = await run_in_thread(snapshot)
+        version = progress["version"]
+        yield format_sse("snapshot", progress)
+        while not await request.is_disconnected():
+            try:
+                event = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+
+            if event is RESYNC:
+                progress = await run_in_thread(snapshot)
+                version = progress["version"]
+                yield format_sse("snapshot", progress)
+                continue
+
+            event = unseen_event(event, version)
+            if event.keys() <= {"query_id"}:
+                continue
+            version = event.get("version", version)
+            yield format_sse("progress", event)
+    finally:
+        query_event_hub.unsubscribe(query_id, queue)
@@ -1,15 +1,42 @@
-from fastapi import FastAPI, HTTPException, Depends, Query as QueryParam
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Depends, Request, Query as QueryParam
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Annotated
+from fastapi.responses import Response, StreamingResponse
+from typing import Annotated, Literal, Optional
+import atexit
+import os
+import shutil
+import tempfile
 from app.db.database import (
+    delete_query,
+    dispose_engines,
+    drop_query_partitions,
     get_db_session,
     get_owned_queries,
+    get_query_archive,
+    get_query_progress,
+    get_query_summary,
+    has_query_results,
+    get_read_db_session,
     save_new_query,
     save_query_result,
+    search_query_results,
     get_query_results,
     get_query_detail,
+    init_engines,
+    prune_query_jobs,
 )
-from app.auth import verify_internal_service
+from app.archive import get_archived_query_results, remove_archive, row_cursor
+from app.auth import API_SECRET_KEY, verify_internal_service
+from app.events import (
+    QueryEventFlusher,
+    QueryEventListener,
+    query_event_batcher,
+    query_event_hub,
+    stream_query_events,
+)
+from app.metrics import MetricsMiddleware, mark_worker_stopped, render_metrics
+from app.profiling import ProfilingMiddleware, run_in_thread
+from app.publisher import publish_query
 from contextlib import asynccontextmanager
 import uvicorn
 from app.models.service import (
@@ -18,17 +45,40 @@ from app.models.service import (
     QueryDetails,
     QueryList,
     QueryResult,
-    QueryJobResult,
+    QuerySummary,
     RegisterQueryRequest,
     RegisterQueryResponse,
+    SearchHit,
+    SearchResults,
 )
 from app.models.query import Query
 from app.response import build_ok_response, error_handler
+from app.wire import decode_job_result
+
+
+# Production server, see start()
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+UVICORN_LOOP = os.getenv("UVICORN_LOOP", "auto")
+UVICORN_HTTP = os.getenv("UVICORN_HTTP", "auto")
+GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30"))
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Runs in every worker process, so each one gets its own pools
+    init_engines()
+    listener = QueryEventListener(os.environ["POSTGRES_URL"], query_event_hub)
+    await listener.start()
+    flusher = QueryEventFlusher(os.environ["POSTGRES_URL"], query_event_batcher)
+    await flusher.start()
     yield
+    # uvicorn has drained in-flight requests by the time shutdown runs
+    await flusher.stop()
+    await listener.stop()
+    await dispose_engines()
+    mark_worker_stopped()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -41,6 +91,19 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware, secret=API_SECRET_KEY)
+
+
+def check_query_owner(query_id: int, user: str):
+    with get_db_session() as session:
+        query = (
+            session.query(Query)
+            .filter(Query.id == query_id, Query.owner == user)
+            .first()
+        )
+        if not query:
+            raise HTTPException(status_code=404, detail="Query not found")
 
 
 @app.get("/")
@@ -53,31 +116,64 @@ async def health_check():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
 @app.post("/register_query")
 @error_handler
 async def register_query(
-    query: RegisterQueryRequest, _: Annotated[bool, Depends(verify_internal_service)]
+    query: RegisterQueryRequest,
+    background_tasks: BackgroundTasks,
+    _: Annotated[bool, Depends(verify_internal_service)],
 ):
-    with get_db_session() as session:
-        query_id = save_new_query(
-            session,
-            dataset=query.dataset,
-            language=query.language,
-            query_text=query.query_text,
-            model=query.model,
-            user=query.user,
-        )
-        return build_ok_response(RegisterQueryResponse(query_id=query_id))
+    def save() -> int:
+        with get_db_session() as session:
+            return save_new_query(
+                session,
+                dataset=query.dataset,
+                language=query.language,
+                query_text=query.query_text,
+                model=query.model,
+                owner=query.user,
+                sample=query.sample,
+                match_target=query.match_target,
+            )
+
+    # Attaching the partitions waits for publishers' transactions, some of
+    # which run on this event loop, so wait in a thread rather than block it
+    query_id = await run_in_thread(save)
+
+    # Previews are cheap, publish them right away instead of waiting for a run
+    if query.sample is not None:
+        background_tasks.add_task(publish_query, query_id)
+    return build_ok_response(RegisterQueryResponse(query_id=query_id))
 
 
 @app.post("/save_query_result")
 @error_handler
 async def save_query_result_callback(
-    result: QueryJobResult, _: Annotated[bool, Depends(verify_internal_service)]
+    request: Request, _: Annotated[bool, Depends(verify_internal_service)]
 ):
-    with get_db_session() as session:
-        save_query_result(session, result)
-        return build_ok_response()
+    """Takes a QueryJobResult as JSON, or as msgpack with Content-Type
+    application/msgpack, either optionally with Content-Encoding: zstd"""
+    body = await request.body()
+
+    def save():
+        # Decompressing and parsing a large body takes a while, keep it off
+        # the event loop too, and decode before taking a connection
+        result = decode_job_result(
+            body,
+            request.headers.get("content-type", ""),
+            request.headers.get("content-encoding", ""),
+        )
+        with get_db_session() as session:
+            save_query_result(session, result)
+
+    await run_in_thread(save)
+    return build_ok_response()
 
 
 @app.get("/queries/{query_id}/results", response_model=PaginatedQueryResults)
@@ -87,85 +183,248 @@ async def get_query_results_endpoint(
     user: str,
     _: Annotated[bool, Depends(verify_internal_service)],
     page: int = QueryParam(default=1, ge=1),
+    after: Optional[int] = QueryParam(default=None, ge=0),
 ):
-    with get_db_session() as session:
-        # Verify query belongs to publisher
-        query = (
-            session.query(Query)
-            .filter(
-                Query.id == query_id,
-                Query.owner == user,
-                Query.status != "pending",
-                Query.results.any(),
+    page_size = 1000
+
+    def load():
+        with get_read_db_session(query_id, settled=True) as session:
+            # Verify query belongs to publisher
+            query = (
+                session.query(Query)
+                .filter(
+                    Query.id == query_id,
+                    Query.owner == user,
+                    Query.status != "pending",
+                )
+                .first()
             )
-            .first()
-        )
 
-        if not query:
-            raise HTTPException(status_code=404, detail="Query not found")
+            if query and query.status == "archived":
+                archive = get_query_archive(session, query_id)
+                return archive.jobs, None, None, None, (archive.location, archive.frames)
+
+            if not query or not has_query_results(session, query_id):
+                raise HTTPException(status_code=404, detail="Query not found")
 
-        # Get paginated results
-        results, total = get_query_results(session, query_id, page)
-
-        page_size = 1000
-        return build_ok_response(
-            PaginatedQueryResults(
-                results=[
-                    QueryResult(
-                        results=r.results,
-                    )
-                    for r in results
-                ],
-                total=total,
-                page=page,
-                page_size=page_size,
-                has_more=total > page * page_size,
+            # Get paginated results
+            rows, total, has_more = get_query_results(
+                session, query_id, page, page_size, after=after
             )
+            results = [r.result for r in rows]
+            cursors = [r.completed_seq for r in rows]
+            return total, results, cursors, has_more, None
+
+    total, results, cursors, has_more, archive = await run_in_thread(load)
+    if archive is not None:
+        # The rows were pruned, stream the page out of the archive instead
+        location, frames = archive
+        rows, has_more = await get_archived_query_results(
+            location, frames, page, page_size, after
+        )
+        results = [row["result"] for row in rows]
+        cursors = [row_cursor(row) for row in rows]
+
+    return build_ok_response(
+        PaginatedQueryResults(
+            results=[QueryResult(results=r) for r in results],
+            total=total,
+            page=page,
+            page_size=page_size,
+            next_cursor=cursors[-1] if has_more else None,
+            has_more=has_more,
         )
+    )
+
+
+@app.get("/queries/{query_id}/summary", response_model=QuerySummary)
+@error_handler
+async def get_query_summary_endpoint(
+    query_id: int,
+    user: str,
+    _: Annotated[bool, Depends(verify_internal_service)],
+    top: int = QueryParam(default=10, ge=1, le=100),
+):
+    def load() -> QuerySummary:
+        with get_db_session() as session:
+            query = (
+                session.query(Query)
+                .filter(Query.id == query_id, Query.owner == user)
+                .first()
+            )
+            if not query:
+                raise HTTPException(status_code=404, detail="Query not found")
+
+            summary = get_query_summary(session, query_id, top)
+            return QuerySummary(
+                query_id=query_id,
+                published=summary["published"],
+                processed=summary["processed"],
+                errored=summary["errored"],
+                matches=summary["matches"],
+                error_codes=summary["error_codes"],
+                top_hosts=summary["top_hosts"],
+            )
+
+    return build_ok_response(await run_in_thread(load))
+
+
+@app.get("/queries/{query_id}/search", response_model=SearchResults)
+@error_handler
+async def search_query_results_endpoint(
+    query_id: int,
+    user: str,
+    q: Annotated[str, QueryParam(min_length=1, max_length=1000)],
+    _: Annotated[bool, Depends(verify_internal_service)],
+    mode: Literal["text", "uri"] = "text",
+    after: Optional[int] = QueryParam(default=None, ge=0),
+    limit: int = QueryParam(default=100, ge=1, le=1000),
+):
+    def search() -> SearchResults:
+        with get_db_session() as session:
+            query = (
+                session.query(Query)
+                .filter(Query.id == query_id, Query.owner == user)
+                .first()
+            )
+            if not query:
+                raise HTTPException(status_code=404, detail="Query not found")
+            if query.status == "archived":
+                # The search index went with the partitions, an empty page
+                # would read as no matches
+                raise HTTPException(status_code=410, detail="Query archived")
+
+            hits, has_more = search_query_results(
+                session, query_id, q, mode=mode, after=after, limit=limit
+            )
+            return SearchResults(
+                hits=[SearchHit(cursor=h.id, uri=h.uri, text=h.text) for h in hits],
+                next_cursor=hits[-1].id if has_more else None,
+                has_more=has_more,
+            )
+
+    return build_ok_response(await run_in_thread(search))
+
+
+@app.get("/queries/{query_id}/events")
+@error_handler
+async def get_query_events(
+    query_id: int,
+    user: str,
+    request: Request,
+    _: Annotated[bool, Depends(verify_internal_service)],
+):
+    await run_in_thread(check_query_owner, query_id, user)
+
+    def snapshot() -> dict:
+        with get_db_session() as session:
+            return get_query_progress(session, query_id)
+
+    return StreamingResponse(
+        stream_query_events(request, query_id, snapshot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/queries/{query_id}", response_model=QueryContext)
 async def get_query_context(
     query_id: int, _: Annotated[bool, Depends(verify_internal_service)]
 ):
-    with get_db_session() as session:
-        query = get_query_detail(session, query_id)
-        if not query:
-            raise HTTPException(status_code=404, detail="Query not found")
-        return build_ok_response(
-            QueryContext(query_text=query.query_text, model=query.model)
-        )
+    def load() -> QueryContext:
+        with get_read_db_session(query_id) as session:
+            query = get_query_detail(session, query_id)
+            if not query:
+                raise HTTPException(status_code=404, detail="Query not found")
+            return QueryContext(query_text=query.query_text, model=query.model)
+
+    return build_ok_response(await run_in_thread(load))
+
+
+@app.delete("/queries/{query_id}")
+@error_handler
+async def delete_query_endpoint(
+    query_id: int,
+    user: str,
+    background_tasks: BackgroundTasks,
+    _: Annotated[bool, Depends(verify_internal_service)],
+):
+    await run_in_thread(check_query_owner, query_id, user)
+
+    # Drop the results wholesale before the query row, so the cascade is a no-op.
+    # The detach waits for transactions of this worker's publisher, which runs
+    # on this event loop, so wait in a thread rather than block it
+    await run_in_thread(drop_query_partitions, query_id)
+
+    def delete() -> Optional[str]:
+        with get_db_session() as session:
+            # The cascade takes the archive row, the file or object stays behind
+            archive = get_query_archive(session, query_id)
+            delete_query(session, query_id)
+            return archive.location if archive else None
+
+    location = await run_in_thread(delete)
+    if location is not None:
+        await remove_archive(location)
+    background_tasks.add_task(prune_query_jobs, query_id)
+    return build_ok_response()
 
 
 @app.get("/queries", response_model=QueryContext)
 async def get_all_queries(
     user: str, _: Annotated[bool, Depends(verify_internal_service)]
 ):
-    with get_db_session() as session:
-        queries = get_owned_queries(session, owner=user)
-        return build_ok_response(
-            QueryList(
-                queries=[
-                    QueryDetails(
-                        query_id=q.id,
-                        dataset=q.dataset,
-                        language=q.language,
-                        query_text=q.query_text,
-                        model=q.model,
-                        created_at=q.created_at,
-                    )
-                    for q in queries
-                ]
-            )
-        )
+    def load() -> list[QueryDetails]:
+        with get_read_db_session() as session:
+            return [
+                QueryDetails(
+                    query_id=q.id,
+                    dataset=q.dataset,
+                    language=q.language,
+                    query_text=q.query_text,
+                    model=q.model,
+                    created_at=q.created_at,
+                )
+                for q in get_owned_queries(session, owner=user)
+            ]
+
+    return build_ok_response(QueryList(queries=await run_in_thread(load)))
 
 
 def start():
-    """Start production server"""
+    """Start production server
+
+    Runs WEB_CONCURRENCY worker processes, each with its own event loop, pools
+    and LISTEN connection. The loop and HTTP parser are uvloop and httptools
+    when installed (`poetry install -E server`), see UVICORN_LOOP/UVICORN_HTTP.
+
+    Routes hand their database work to the loop's default thread pool, so a
+    slow query blocks one thread rather than the worker, but parsing and
+    serializing still hold the GIL. There is no measured default: take
+    WEB_CONCURRENCY from `poetry run worker-sweep` on the host class the
+    server runs on, the smallest count past which callback throughput stops
+    growing. On a single core, 2 workers measured slower than 1.
+
+    Every worker may hold 2 * (DB_POOL_SIZE + DB_MAX_OVERFLOW) + 2
+    connections, its sync and async pools plus the query event listener and
+    flusher. Keep the total under
+    Postgres max_connections, lowering the pool size as workers go up. With
+    POSTGRES_REPLICA_URL set, each worker holds one more pool on the replica.
+    """
+    if WEB_CONCURRENCY > 1 and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        # Workers share their metrics through files, or /metrics shows one worker
+        metrics_dir = tempfile.mkdtemp(prefix="metrics-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+        atexit.register(shutil.rmtree, metrics_dir, ignore_errors=True)
+
     uvicorn.run(
         "app.main:app",
-        host="0.0.0.0",
-        port=8000,
+        host=HOST,
+        port=PORT,
+        workers=WEB_CONCURRENCY,
+        loop=UVICORN_LOOP,
+        http=UVICORN_HTTP,
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS,
         proxy_headers=True,
         forwarded_allow_ips="*",
     )
@@ -0,0 +1,150 @@
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+# Routes
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time until the response starts, by route template",
+    ["method", "route", "status"],
+)
+HTTP_UNHANDLED_ERRORS = Counter(
+    "http_unhandled_errors_total",
+    "Exceptions turned into 500s by error_handler",
+    ["handler"],
+)
+
+# Database pool
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections",
+    "Connections currently checked out of the pool",
+    multiprocess_mode="livesum",
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time get_db_session waited for a pooled connection",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+# Read replica
+DB_READ_SESSIONS = Counter(
+    "db_read_sessions_total",
+    "Read-only sessions by where get_read_db_session routed them, and why",
+    ["target", "reason"],
+)
+DB_REPLICA_LAG = Gauge(
+    "db_replica_lag_seconds",
+    "Replay lag of the read replica at its last routing decision",
+    multiprocess_mode="max",
+)
+
+# Publisher
+PUBLISH_PHASE_DURATION = Histogram(
+    "publish_phase_duration_seconds",
+    "Time spent per phase of publishing a batch of classify jobs",
+    ["phase"],
+)
+PUBLISH_BATCH_SIZE = Histogram(
+    "publish_batch_size",
+    "Jobs per published batch",
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+PUBLISH_ERRORS = Counter(
+    "publish_errors_total", "Batches the Mizu node failed to accept"
+)
+
+# Result callbacks, rate() of the total gives callbacks/sec
+RESULT_CALLBACKS = Counter(
+    "result_callbacks_total",
+    "Result callbacks received from the Mizu node",
+    ["outcome"],
+)
+RESULT_CALLBACK_BYTES = Counter(
+    "result_callback_bytes_total",
+    "Result callback bytes received, as sent",
+    ["encoding"],
+)
+
+# Dataset loader
+DATASET_OBJECTS_LISTED = Counter(
+    "dataset_objects_listed_total", "R2 objects listed by the dataset loader"
+)
+DATASET_ROWS_INSERTED = Counter(
+    "dataset_rows_inserted_total", "Dataset rows submitted for insert"
+)
+DATASET_INSERT_DURATION = Histogram(
+    "dataset_insert_duration_seconds", "Time to insert one batch of dataset rows"
+)
+
+
+@event.listens_for(Pool, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    DB_POOL_CHECKED_OUT.inc()
+
+
+@event.listens_for(Pool, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    DB_POOL_CHECKED_OUT.dec()
+
+
+class MetricsMiddleware:
+    """Records route latency as a plain ASGI middleware, so streams are not buffered"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        recorded = False
+
+        def record(status: int):
+            nonlocal recorded
+            recorded = True
+            # Label by template so path parameters don't explode cardinality
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                method=scope["method"],
+                route=route.path if route else "unmatched",
+                status=status,
+            ).observe(time.perf_counter() - started)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Raised before the response started, the server answers with a 500
+            if not recorded:
+                record(500)
+
+
+def mark_worker_stopped():
+    """Drops the live gauges of this worker, so they stop counting towards livesum"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Renders the metrics of this process, or of all workers in multiprocess mode"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
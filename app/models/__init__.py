@@ -1,6 +1,10 @@
 from .base import Base
 from .dataset import Dataset
 from .query import Query
+from .query_archive import QueryArchive
+from .query_job import QueryJob
 from .query_result import QueryResult
+from .query_result_entry import QueryResultEntry
+from .query_summary import QueryFacetCount, QuerySummary
 
-__all__ = ['Base', 'Dataset', 'Query', 'QueryResult']
+__all__ = ['Base', 'Dataset', 'Query', 'QueryArchive', 'QueryJob', 'QueryResult', 'QueryResultEntry', 'QueryFacetCount', 'QuerySummary']
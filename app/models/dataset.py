@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, BigInteger, DateTime, Text
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime, Text, Float, Computed
 from .base import Base
 
 
@@ -17,6 +17,14 @@ class Dataset(Base):
     byte_size = Column(BigInteger, default=0)
     source = Column(Text, default="")
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    # Uniform in [0, 1) and stable per shard, sampled queries take a range of it
+    sample_key = Column(
+        Float,
+        Computed(
+            "(hashtext(md5::text)::bigint + 2147483648) / 4294967296.0",
+            persisted=True,
+        ),
+    )
 
     def __repr__(self):
         return f"<Dataset(name='{self.name}', language='{self.language}', data_type='{self.data_type}')>"
@@ -1,5 +1,5 @@
-from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, BigInteger, Float, String, DateTime, Text
 from sqlalchemy.orm import relationship
 from .base import Base
 
@@ -15,13 +15,30 @@ class Query(Base):
     owner = Column(String(255), nullable=False)
     status = Column(String(50), default="pending")
     created_at = Column(
-        DateTime(timezone=True), default=lambda: datetime.now(datetime.UTC)
+        DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
     )
+    # Preview on a random subset of the dataset, at most one limit is set
+    sample_fraction = Column(Float)
+    sample_shards = Column(Integer)
+    sample_bytes = Column(BigInteger)
+    sample_seed = Column(Integer)
+    # Stop publishing once this many matches came back
+    match_target = Column(Integer)
 
-    # Relationship to QueryResult
+    # Relationship to QueryResult, rows go away with the query's partition
     results = relationship(
-        "QueryResult", back_populates="query", cascade="all, delete-orphan"
+        "QueryResult",
+        back_populates="query",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
     )
 
+    @property
+    def is_sample(self) -> bool:
+        return any(
+            limit is not None
+            for limit in (self.sample_fraction, self.sample_shards, self.sample_bytes)
+        )
+
     def __repr__(self):
         return f"<Query(id={self.id}, query_text='{self.query_text[:50]}...', dataset='{self.dataset}'), language='{self.language}', model='{self.model}', owner='{self.owner}')>"
@@ -0,0 +1,25 @@
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey, JSON
+from .base import Base
+
+
+class QueryArchive(Base):
+    """Where the results of an archived query live once pruned from Postgres"""
+
+    __tablename__ = "query_archives"
+
+    query_id = Column(
+        Integer, ForeignKey("queries.id", ondelete="CASCADE"), primary_key=True
+    )
+    location = Column(Text, nullable=False)
+    codec = Column(String(20), nullable=False)
+    jobs = Column(Integer, nullable=False)
+    byte_size = Column(BigInteger, nullable=False)
+    # Byte ranges of the archive's frames, see app.archive.write_archive_file
+    frames = Column(JSON, nullable=False)
+    archived_at = Column(
+        DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
+    )
+
+    def __repr__(self):
+        return f"<QueryArchive(query_id={self.query_id}, location='{self.location}')>"
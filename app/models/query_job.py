@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String
+from .base import Base
+
+
+class QueryJob(Base):
+    """Routes a Mizu job id to the query whose partition holds its result
+
+    No foreign key to queries: the rows of a deleted or archived query are
+    pruned in batches by prune_query_jobs rather than by a cascading delete.
+    """
+
+    __tablename__ = "query_jobs"
+
+    job_id = Column(String(255), primary_key=True)
+    query_id = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<QueryJob(job_id={self.job_id}, query_id={self.query_id})>"
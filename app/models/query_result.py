@@ -1,21 +1,25 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON
+from sqlalchemy import BigInteger, Column, Integer, String, DateTime, ForeignKey, JSON
 from sqlalchemy.orm import relationship
 from .base import Base
 
 
 class QueryResult(Base):
     __tablename__ = "query_results"
+    # One partition per query, see migrations/003_partition_query_results.sql
+    __table_args__ = {"postgresql_partition_by": "LIST (query_id)"}
 
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     query_id = Column(
-        Integer, ForeignKey("queries.id", ondelete="CASCADE"), nullable=False
+        Integer, ForeignKey("queries.id", ondelete="CASCADE"), primary_key=True
     )
     job_id = Column(String(255), nullable=False)
     data_id = Column(Integer, nullable=False)
     result = Column(JSON)
     status = Column(String(20), default="pending", nullable=False)
     finished_at = Column(DateTime(timezone=True))
+    # Per-query completion order, results are paged by it, see save_query_result
+    completed_seq = Column(BigInteger)
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
 
     # Relationship
@@ -0,0 +1,32 @@
+from sqlalchemy import Column, Integer, BigInteger, Text, ForeignKey, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from .base import Base
+
+# Longer texts are truncated before indexing, tsvector values are capped at 1MB
+MAX_INDEXED_TEXT_LENGTH = 100000
+
+
+class QueryResultEntry(Base):
+    """One ClassifyResult extracted from a job's result for searching"""
+
+    __tablename__ = "query_result_entries"
+    # Partitioned alongside query_results
+    __table_args__ = {"postgresql_partition_by": "LIST (query_id)"}
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    query_id = Column(
+        Integer, ForeignKey("queries.id", ondelete="CASCADE"), primary_key=True
+    )
+    result_id = Column(Integer, nullable=False)
+    uri = Column(Text, nullable=False)
+    text = Column(Text, nullable=False)
+    search_vector = Column(
+        TSVECTOR,
+        Computed(
+            f"to_tsvector('simple', left(text, {MAX_INDEXED_TEXT_LENGTH}))",
+            persisted=True,
+        ),
+    )
+
+    def __repr__(self):
+        return f"<QueryResultEntry(id={self.id}, query_id={self.query_id}, uri='{self.uri}')>"
@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey
+from .base import Base
+
+
+class QuerySummary(Base):
+    __tablename__ = "query_summaries"
+
+    query_id = Column(
+        Integer, ForeignKey("queries.id", ondelete="CASCADE"), primary_key=True
+    )
+    published = Column(Integer, default=0, nullable=False)
+    processed = Column(Integer, default=0, nullable=False)
+    errored = Column(Integer, default=0, nullable=False)
+    matches = Column(BigInteger, default=0, nullable=False)
+    # Last completion sequence number handed out, see QueryResult.completed_seq
+    last_cursor = Column(BigInteger)
+    # Bumped by every update, see app.events.merge_event
+    version = Column(BigInteger, default=0, nullable=False)
+    updated_at = Column(
+        DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
+    )
+
+    def __repr__(self):
+        return f"<QuerySummary(query_id={self.query_id}, published={self.published}, processed={self.processed}, errored={self.errored})>"
+
+
+class QueryFacetCount(Base):
+    __tablename__ = "query_facet_counts"
+
+    query_id = Column(
+        Integer, ForeignKey("queries.id", ondelete="CASCADE"), primary_key=True
+    )
+    facet = Column(String(20), primary_key=True)
+    value = Column(String(255), primary_key=True)
+    count = Column(BigInteger, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<QueryFacetCount(query_id={self.query_id}, facet='{self.facet}', value='{self.value}', count={self.count})>"
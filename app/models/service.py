@@ -2,7 +2,8 @@ from datetime import datetime
 from typing import List, Optional
 from pydantic import BaseModel, ConfigDict, Field
 
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from typing_extensions import NotRequired, TypedDict
 
 
 class ClassifyResult(BaseModel):
@@ -28,6 +29,8 @@ class BatchClassifyContext(BaseModel):
     decompressed_byte_size: int = Field(alias="decompressedByteSize")
     checksum_md5: str = Field(alias="checksumMd5")
     classifier_id: int = Field(alias="classifierId")
+    # Local dataset id, kept to link the job back, never sent to the node
+    data_id: int = Field(alias="dataId", exclude=True)
 
 
 class PublishBatchClassifyJobRequest(BaseModel):
@@ -44,6 +47,24 @@ class QueryJobResult(BaseModel):
     batch_classify_result: list[ClassifyResult] = Field(alias="batchClassifyResult", default=[])
 
 
+# QueryJobResult as plain dicts in its wire form, validated without building
+# models so the results go into the JSONB column as they arrived
+class ClassifyResultPayload(TypedDict):
+    uri: str
+    text: str
+
+
+class ErrorResultPayload(TypedDict):
+    code: int
+    message: NotRequired[Optional[str]]
+
+
+class QueryJobResultPayload(TypedDict):
+    jobId: str
+    errorResult: NotRequired[Optional[ErrorResultPayload]]
+    batchClassifyResult: NotRequired[list[ClassifyResultPayload]]
+
+
 class QueryResult(BaseModel):
     model_config = ConfigDict(populate_by_name=True)
 
@@ -57,9 +78,45 @@ class PaginatedQueryResults(BaseModel):
     total: int
     page: int
     page_size: int = Field(alias="pageSize")
+    next_cursor: Optional[int] = Field(alias="nextCursor", default=None)
     has_more: bool
 
 
+class FacetCount(BaseModel):
+    model_config = ConfigDict(populate_by_name=True, from_attributes=True)
+
+    value: str
+    count: int
+
+
+class QuerySummary(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    query_id: int = Field(alias="queryId")
+    published: int
+    processed: int
+    errored: int
+    matches: int
+    error_codes: list[FacetCount] = Field(alias="errorCodes", default=[])
+    top_hosts: list[FacetCount] = Field(alias="topHosts", default=[])
+
+
+class SearchHit(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    cursor: int
+    uri: str
+    text: str
+
+
+class SearchResults(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    hits: list[SearchHit] = Field(alias="hits", default=[])
+    next_cursor: Optional[int] = Field(alias="nextCursor", default=None)
+    has_more: bool = Field(alias="hasMore")
+
+
 class QueryContext(BaseModel):
     model_config = ConfigDict(populate_by_name=True)
 
@@ -67,6 +124,28 @@ class QueryContext(BaseModel):
     model: str
 
 
+class QuerySample(BaseModel):
+    """A random subset of the dataset to preview a query on
+
+    Exactly one of fraction, shards and maxBytes, the same seed always
+    selects the same shards.
+    """
+
+    model_config = ConfigDict(populate_by_name=True)
+
+    fraction: Optional[float] = Field(default=None, gt=0, le=1)
+    shards: Optional[int] = Field(default=None, ge=1)
+    max_bytes: Optional[int] = Field(alias="maxBytes", default=None, ge=1)
+    seed: int = Field(default=0, ge=0, le=2**31 - 1)
+
+    @model_validator(mode="after")
+    def check_single_limit(self):
+        limits = [self.fraction, self.shards, self.max_bytes]
+        if sum(limit is not None for limit in limits) != 1:
+            raise ValueError("Set exactly one of fraction, shards and maxBytes")
+        return self
+
+
 class RegisterQueryRequest(BaseModel):
     model_config = ConfigDict(populate_by_name=True)
 
@@ -75,6 +154,8 @@ class RegisterQueryRequest(BaseModel):
     query_text: str = Field(alias="queryText")
     model: str
     user: str
+    sample: Optional[QuerySample] = Field(default=None)
+    match_target: Optional[int] = Field(alias="matchTarget", default=None, ge=1)
 
 
 class RegisterQueryResponse(BaseModel):
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Fraction of requests profiled without being asked to, 0 disables sampling
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_HEADER = b"x-profile"
+
+# Statements slower than this are logged with their plan, on every request
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() == "true"
+EXPLAINABLE = ("select", "insert", "update", "delete", "with")
+
+logger = logging.getLogger(__name__)
+
+# SQL statements of the request being profiled, None when not profiling
+_sql_trace: ContextVar = ContextVar("sql_trace", default=None)
+# Sampler of the request being profiled, None when not profiling
+_sampler: ContextVar = ContextVar("sampler", default=None)
+
+
+def install_sql_tracing(engine: Engine):
+    """Times every statement of the engine for traces and the slow query log"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute
+    if context.connection is not None:
+        context.connection.info.pop("query_started", None)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info.pop("query_started")) * 1000
+
+    trace = _sql_trace.get()
+    if trace is not None:
+        trace.append(
+            {
+                "statement": statement,
+                "duration_ms": round(elapsed_ms, 3),
+                "rowcount": cursor.rowcount,
+                "executemany": executemany,
+            }
+        )
+
+    if elapsed_ms >= SLOW_QUERY_MS:
+        plan = None
+        if SLOW_QUERY_EXPLAIN and not executemany:
+            plan = _explain(conn, statement, parameters)
+        logger.warning(
+            f"Slow query ({elapsed_ms:.0f} ms): {statement}"
+            + (f"\n{plan}" if plan else "")
+        )
+
+
+def _explain(conn, statement: str, parameters) -> str:
+    if not statement.lstrip().lower().startswith(EXPLAINABLE):
+        return None
+    # Same connection and transaction, so the plan sees what the query saw. The
+    # DBAPI connection rather than the statement's cursor: asyncpg's adapted
+    # cursor has no way back to its connection
+    dbapi_connection = conn.connection.dbapi_connection
+    # A failing EXPLAIN would abort the request's transaction, unless it runs
+    # under a savepoint that is rolled back
+    savepoint = not getattr(dbapi_connection, "autocommit", False)
+    explain_cursor = dbapi_connection.cursor()
+    try:
+        if savepoint:
+            explain_cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            explain_cursor.execute(f"EXPLAIN {statement}", parameters)
+            plan = "\n".join(row[0] for row in explain_cursor.fetchall())
+        except Exception as e:
+            if savepoint:
+                explain_cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            return f"EXPLAIN failed: {str(e)}"
+        if savepoint:
+            explain_cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        return plan
+    except Exception as e:
+        return f"EXPLAIN failed: {str(e)}"
+    finally:
+        explain_cursor.close()
+
+
+async def run_in_thread(func, /, *args, **kwargs):
+    """asyncio.to_thread, with the thread sampled while it works for a profiled request"""
+    sampler = _sampler.get()
+    if sampler is None:
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    def run():
+        thread_id = threading.get_ident()
+        sampler.add_thread(thread_id)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sampler.remove_thread(thread_id)
+
+    return await asyncio.to_thread(run)
+
+
+class TaskSampler:
+    """Samples the stack of the event loop thread while a given task is running,
+    and of the threads doing its work through run_in_thread
+
+    Samples taken while another task runs on the loop are discarded, so
+    concurrent requests do not pollute the profile.
+    """
+
+    def __init__(self, task: asyncio.Task, interval: float):
+        self.stacks = Counter()
+        self.samples = 0
+        self._task = task
+        self._loop = task.get_loop()
+        self._thread_id = threading.get_ident()
+        self._threads: set[int] = set()
+        self._threads_lock = threading.Lock()
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def add_thread(self, thread_id: int):
+        with self._threads_lock:
+            self._threads.add(thread_id)
+
+    def remove_thread(self, thread_id: int):
+        with self._threads_lock:
+            self._threads.discard(thread_id)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self.samples += 1
+            with self._threads_lock:
+                thread_ids = set(self._threads)
+            if asyncio.current_task(self._loop) is self._task:
+                thread_ids.add(self._thread_id)
+            if not thread_ids:
+                continue
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[_fold(frame)] += 1
+
+
+def _fold(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def _write_profile(profile_id: str, sampler: TaskSampler, report: dict):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, profile_id)
+    # Collapsed stacks, readable by flamegraph.pl and speedscope
+    with open(f"{base}.folded", "w") as f:
+        for stack, count in sampler.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    with open(f"{base}.json", "w") as f:
+        json.dump(report, f, indent=2, default=str)
+
+
+class ProfilingMiddleware:
+    """Profiles sampled requests and requests sending an authenticated X-Profile header
+
+    Writes a collapsed-stack profile and a JSON report with the SQL trace to
+    PROFILE_DIR, and returns the profile id in the X-Profile-Id header.
+    """
+
+    def __init__(self, app, secret: str):
+        self.app = app
+        self._authorization = f"Bearer {secret}".encode()
+
+    def _should_profile(self, scope) -> bool:
+        headers = dict(scope["headers"])
+        if headers.get(PROFILE_HEADER) and headers.get(b"authorization") == self._authorization:
+            return True
+        return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            return await self.app(scope, receive, send)
+
+        started_at = datetime.now(timezone.utc)
+        profile_id = f"{started_at:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile_id.encode())
+                ]
+            await send(message)
+
+        trace = []
+        token = _sql_trace.set(trace)
+        sampler = TaskSampler(asyncio.current_task(), PROFILE_INTERVAL_MS / 1000)
+        sampler_token = _sampler.set(sampler)
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            sampler.stop()
+            _sampler.reset(sampler_token)
+            _sql_trace.reset(token)
+
+            report = {
+                "id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "query_string": scope["query_string"].decode(),
+                "status": status,
+                "started_at": started_at,
+                "duration_ms": round(elapsed_ms, 3),
+                "samples": sampler.samples,
+                "samples_in_request": sum(sampler.stacks.values()),
+                "sql_total_ms": round(sum(s["duration_ms"] for s in trace), 3),
+                "sql": trace,
+            }
+            await asyncio.to_thread(_write_profile, profile_id, sampler, report)
+            logger.info(
+                f"Profiled {scope['method']} {scope['path']} in {elapsed_ms:.0f} ms"
+                f" ({len(trace)} statements), written to {PROFILE_DIR}/{profile_id}"
+            )
@@ -1,44 +1,162 @@
+import asyncio
+import logging
+import math
 import os
+import random
+import time
 from typing import Any, AsyncGenerator
 import aiohttp
-from sqlalchemy import select, func
+from sqlalchemy import select, tuple_, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.database import get_async_db_session
+from app.db.summary import QUERY_PROGRESS_COLUMNS, query_progress, query_summary_upsert
+from app.events import query_event
+from app.metrics import PUBLISH_BATCH_SIZE, PUBLISH_ERRORS, PUBLISH_PHASE_DURATION
+from app.models.query_job import QueryJob
 from app.models.query_result import QueryResult
+from app.models.query_summary import QuerySummary
 from app.models.service import PublishBatchClassifyJobRequest, BatchClassifyContext
 from app.models.dataset import Dataset
 from app.models.query import Query
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 BATCH_SIZE = 1000
 
+# Queries with a match target are published in waves. The first wave has
+# PUBLISH_WAVE_SIZE shards, the next one waits until PUBLISH_WAVE_DRAIN of the
+# published jobs reported back and is sized from the match rate so far.
+PUBLISH_WAVE_SIZE = int(os.getenv("PUBLISH_WAVE_SIZE", "10000"))
+PUBLISH_WAVE_MAX = int(os.getenv("PUBLISH_WAVE_MAX", "200000"))
+PUBLISH_WAVE_DRAIN = float(os.getenv("PUBLISH_WAVE_DRAIN", "0.9"))
+PUBLISH_WAVE_POLL_SECONDS = float(os.getenv("PUBLISH_WAVE_POLL_SECONDS", "2"))
+PUBLISH_WAVE_TIMEOUT_SECONDS = float(os.getenv("PUBLISH_WAVE_TIMEOUT_SECONDS", "3600"))
 
-async def create_batch_classify_requests(
-    session: AsyncSession, query: Query
-) -> AsyncGenerator[PublishBatchClassifyJobRequest, None]:
-    """Creates batch classify requests for dataset records in batches"""
-    # Get total count for offset calculation
-    count_stmt = (
-        select(func.count())
-        .select_from(Dataset)
-        .where(Dataset.language == query.language, Dataset.name == query.dataset)
-    )
-    total_count = await session.scalar(count_stmt)
 
-    if not total_count:
-        raise ValueError(f"No dataset found for query: {query.query_text}")
+async def iter_datasets(
+    session: AsyncSession, query: Query
+) -> AsyncGenerator[list[Dataset], None]:
+    """Yields every shard of the query's dataset in batches
 
-    # Process datasets in batches using offset/limit
-    for offset in range(0, total_count, BATCH_SIZE):
+    Pages by id rather than by offset: batches are committed in between, and
+    a keyset stays put when shards are loaded or removed meanwhile.
+    """
+    last_id = 0
+    while True:
         stmt = (
             select(Dataset)
-            .where(Dataset.language == query.language, Dataset.name == query.dataset)
-            .offset(offset)
+            .where(
+                Dataset.language == query.language,
+                Dataset.name == query.dataset,
+                Dataset.id > last_id,
+            )
+            .order_by(Dataset.id)
             .limit(BATCH_SIZE)
         )
 
+        started = time.perf_counter()
         result = await session.execute(stmt)
         batch_datasets = result.scalars().all()
+        PUBLISH_PHASE_DURATION.labels(phase="dataset_query").observe(
+            time.perf_counter() - started
+        )
+
+        if not batch_datasets:
+            if not last_id:
+                raise ValueError(f"No dataset found for query: {query.query_text}")
+            return
+        yield batch_datasets
+        if len(batch_datasets) < BATCH_SIZE:
+            return
+        last_id = batch_datasets[-1].id
+
+
+def sample_start(seed: int) -> float:
+    """Where on the sample_key circle the sample of a seed starts"""
+    return random.Random(seed).random()
+
+
+async def iter_sampled_datasets(
+    session: AsyncSession, query: Query
+) -> AsyncGenerator[list[Dataset], None]:
+    """Yields the shards of the query's sample in batches
+
+    sample_key is uniform over [0, 1), so any arc of it is a random sample.
+    The walk starts at the seed's point and wraps around past 1, taking the
+    arc of the sampled fraction or shards in key order until the shard count or
+    byte budget runs out. Each batch is a range scan of idx_datasets_sample.
+    """
+    start = sample_start(query.sample_seed or 0)
+    end = start + (query.sample_fraction or 1.0)
+    arcs = [(start, min(end, 1.0))]
+    if end > 1.0:
+        arcs.append((0.0, end - 1.0))
 
+    shards_left = query.sample_shards
+    bytes_left = query.sample_bytes
+    selected = 0
+    for low, high in arcs:
+        after = None
+        while True:
+            limit = BATCH_SIZE if shards_left is None else min(BATCH_SIZE, shards_left)
+            stmt = select(Dataset).where(
+                Dataset.name == query.dataset,
+                Dataset.language == query.language,
+                Dataset.sample_key < high,
+            )
+            if after is None:
+                stmt = stmt.where(Dataset.sample_key >= low)
+            else:
+                stmt = stmt.where(tuple_(Dataset.sample_key, Dataset.id) > after)
+            stmt = stmt.order_by(Dataset.sample_key, Dataset.id).limit(limit)
+
+            started = time.perf_counter()
+            result = await session.execute(stmt)
+            batch_datasets = result.scalars().all()
+            PUBLISH_PHASE_DURATION.labels(phase="dataset_query").observe(
+                time.perf_counter() - started
+            )
+            if not batch_datasets:
+                break
+            after = (batch_datasets[-1].sample_key, batch_datasets[-1].id)
+
+            exhausted = False
+            if bytes_left is not None:
+                fitting = []
+                for dataset in batch_datasets:
+                    if dataset.byte_size > bytes_left:
+                        exhausted = True
+                        break
+                    bytes_left -= dataset.byte_size
+                    fitting.append(dataset)
+                batch_datasets = fitting
+            if shards_left is not None:
+                shards_left -= len(batch_datasets)
+                exhausted = exhausted or shards_left == 0
+
+            if batch_datasets:
+                selected += len(batch_datasets)
+                yield batch_datasets
+            if exhausted:
+                return
+            if len(batch_datasets) < limit:
+                break
+
+    if not selected:
+        raise ValueError(f"No dataset found for query sample: {query.query_text}")
+
+
+async def create_batch_classify_requests(
+    session: AsyncSession, query: Query
+) -> AsyncGenerator[PublishBatchClassifyJobRequest, None]:
+    """Creates batch classify requests for dataset records in batches"""
+    batches = (
+        iter_sampled_datasets(session, query)
+        if query.is_sample
+        else iter_datasets(session, query)
+    )
+    async for batch_datasets in batches:
         # Create contexts for this batch
         batch_contexts = []
         for dataset in batch_datasets:
@@ -49,6 +167,7 @@ async def create_batch_classify_requests(
                 decompressedByteSize=dataset.decompressed_byte_size,
                 checksumMd5=dataset.md5,
                 classifierId=query.id,
+                dataId=dataset.id,
             )
             batch_contexts.append(context)
 
@@ -77,30 +196,173 @@ async def save_batch_query_results(
             created_at=datetime.utcnow(),
         )
         session.add(query_result)
+        session.add(QueryJob(job_id=job_id, query_id=query.id))
 
-    # Update query status
-    query.status = "published"
-    query.total_published += len(batch_contexts)
+    progress = (
+        await session.execute(
+            query_summary_upsert(query.id, published=len(batch_contexts))
+            .returning(*QUERY_PROGRESS_COLUMNS)
+        )
+    ).one()
+    query_event(session, query.id, **query_progress(progress))
 
+    started = time.perf_counter()
     await session.flush()
+    PUBLISH_PHASE_DURATION.labels(phase="db_write").observe(
+        time.perf_counter() - started
+    )
+
+
+async def set_query_status(
+    session: AsyncSession, query: Query, status: str, current: list[str]
+) -> bool:
+    """Moves the query to `status` unless a callback moved it on meanwhile"""
+    result = await session.execute(
+        update(Query)
+        .where(Query.id == query.id, Query.status.in_(current))
+        .values(status=status)
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+    return result.rowcount > 0
+
+
+async def wait_for_wave(session: AsyncSession, query: Query):
+    """Waits until enough of the published jobs reported back, or the target is met
+
+    Returns the query's (published, finished, matches).
+    """
+    started = time.monotonic()
+    while True:
+        row = (
+            await session.execute(
+                select(
+                    QuerySummary.published,
+                    QuerySummary.processed + QuerySummary.errored,
+                    QuerySummary.matches,
+                ).where(QuerySummary.query_id == query.id)
+            )
+        ).one()
+        # End the snapshot, the next poll has to see new callbacks
+        await session.commit()
+
+        published, finished, matches = row
+        if (
+            matches >= query.match_target
+            or finished >= published * PUBLISH_WAVE_DRAIN
+            or time.monotonic() - started > PUBLISH_WAVE_TIMEOUT_SECONDS
+        ):
+            return published, finished, matches
+        await asyncio.sleep(PUBLISH_WAVE_POLL_SECONDS)
+
+
+def next_wave_size(
+    target: int, published: int, finished: int, matches: int, previous: int
+) -> int:
+    """Shards expected to make up the missing matches at the rate seen so far
+
+    0 when the jobs still running are expected to make them up on their own.
+    """
+    if not matches or not finished:
+        size = previous * 2
+    else:
+        rate = matches / finished
+        # Jobs still running count towards the target too
+        missing = target - matches - (published - finished) * rate
+        if missing <= 0:
+            return 0
+        size = math.ceil(missing / rate * 1.25)
+    return max(BATCH_SIZE, min(size, PUBLISH_WAVE_MAX))
+
+
+async def next_wave(session: AsyncSession, query: Query, previous: int) -> int:
+    """Waits until the next wave is due and returns its size, 0 once the target is met
+
+    While the running jobs are expected to meet the target, keeps polling
+    instead of publishing more. Jobs still out after
+    PUBLISH_WAVE_TIMEOUT_SECONDS are presumed lost and no longer counted.
+    """
+    started = time.monotonic()
+    while True:
+        published, finished, matches = await wait_for_wave(session, query)
+        if matches >= query.match_target:
+            return 0
+        if time.monotonic() - started > PUBLISH_WAVE_TIMEOUT_SECONDS:
+            published = finished
+        size = next_wave_size(query.match_target, published, finished, matches, previous)
+        if size:
+            return size
+        await asyncio.sleep(PUBLISH_WAVE_POLL_SECONDS)
 
 
 async def process_query(session: AsyncSession, query: Query):
-    """Main function to process query and create jobs"""
+    """Main function to process query and create jobs
+
+    Commits after every batch: the node runs the jobs it accepted whatever
+    happens to later batches, and short transactions keep the query row free
+    for registrations attaching their partitions.
+
+    With a match target, shards are published in waves and publishing stops
+    once the target is met. The callback that meets it marks the query
+    processed, see complete_query_at_target.
+    """
     try:
+        await set_query_status(session, query, "publishing", ["pending"])
+
+        wave_size = PUBLISH_WAVE_SIZE if query.match_target else None
+        wave_published = 0
         async for batch_request in create_batch_classify_requests(session, query):
+            if wave_size is not None and wave_published >= wave_size:
+                wave_size = await next_wave(session, query, wave_size)
+                if not wave_size:
+                    break
+                wave_published = 0
+
             # First publish the batch
             response = await publish_batch_classify_jobs(batch_request)
 
             # Then create QueryResults with the returned job ID
             await save_batch_query_results(session, query, response, batch_request.data)
+            await session.commit()
+            wave_published += len(batch_request.data)
 
-        await session.commit()
+        # Stays processed if a callback already met the match target
+        await set_query_status(session, query, "published", ["publishing"])
     except Exception as e:
         await session.rollback()
         raise
 
 
+async def publish_query(query_id: int):
+    """Publishes a registered query in its own session, previews start this way
+
+    Runs as a background task with nobody to report to, so a failure is
+    logged and moves the query to 'failed' rather than leave it publishing.
+    """
+    try:
+        async with get_async_db_session() as session:
+            query = await session.get(Query, query_id)
+            if query is None:
+                # Deleted before publishing started
+                return
+            await process_query(session, query)
+    except Exception:
+        logger.exception(f"Publishing query {query_id} failed")
+        await fail_query(query_id)
+
+
+async def fail_query(query_id: int):
+    async with get_async_db_session() as session:
+        result = await session.execute(
+            update(Query)
+            .where(Query.id == query_id, Query.status.in_(["pending", "publishing"]))
+            .values(status="failed")
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            query_event(session, query_id, status="failed")
+
+
 async def publish_batch_classify_jobs(
     request: PublishBatchClassifyJobRequest,
 ) -> dict[str, Any]:
@@ -108,9 +370,25 @@ async def publish_batch_classify_jobs(
     mizu_url = os.environ["MIZU_NODE_SERVICE_URL"]
     endpoint = f"{mizu_url}/publish_batch_classify_job"
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            endpoint, json=request.model_dump(by_alias=True)
-        ) as response:
-            response.raise_for_status()
-            return await response.json()
+    started = time.perf_counter()
+    body = request.model_dump_json(by_alias=True)
+    PUBLISH_PHASE_DURATION.labels(phase="serialize").observe(
+        time.perf_counter() - started
+    )
+    PUBLISH_BATCH_SIZE.observe(len(request.data))
+
+    started = time.perf_counter()
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                endpoint, data=body, headers={"Content-Type": "application/json"}
+            ) as response:
+                response.raise_for_status()
+                return await response.json()
+    except aiohttp.ClientError:
+        PUBLISH_ERRORS.inc()
+        raise
+    finally:
+        PUBLISH_PHASE_DURATION.labels(phase="node").observe(
+            time.perf_counter() - started
+        )
@@ -6,15 +6,18 @@ from fastapi import HTTPException, status
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
+from app.metrics import HTTP_UNHANDLED_ERRORS
+
 
 def error_handler(func):
     @wraps(func)
-    def wrapper(*args, **kwargs):
+    async def wrapper(*args, **kwargs):
         try:
-            return func(*args, **kwargs)
+            return await func(*args, **kwargs)
         except HTTPException as e:
             return build_json_response(e.status_code, e.detail)
         except Exception as e:
+            HTTP_UNHANDLED_ERRORS.labels(handler=func.__name__).inc()
             print(traceback.format_exc())
             return build_json_response(
                 status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -31,7 +34,7 @@ def build_json_response(
         status_code=status_code,
         content={
             "message": message,
-            "data": data.model_dump(by_alias=True, exclude_none=True) if data else {},
+            "data": data.model_dump(mode="json", by_alias=True, exclude_none=True) if data else {},
         },
     )
 
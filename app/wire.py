@@ -0,0 +1,108 @@
+import os
+
+import msgpack
+import zstandard
+from fastapi import HTTPException, status
+from pydantic import TypeAdapter, ValidationError
+
+from app.metrics import RESULT_CALLBACK_BYTES
+from app.models.service import QueryJobResultPayload
+
+# Result callbacks are JSON by default, the node may send msgpack instead and
+# compress either with Content-Encoding: zstd
+JSON_TYPES = {"", "application/json"}
+MSGPACK_TYPES = {"application/msgpack", "application/x-msgpack", "application/vnd.msgpack"}
+ZSTD_ENCODING = "zstd"
+
+# Upper bound on a decompressed callback body, guards against zstd bombs
+MAX_CALLBACK_BYTES = int(os.getenv("MAX_CALLBACK_BYTES", str(256 * 1024 * 1024)))
+ZSTD_READ_SIZE = 1024 * 1024
+
+query_job_result_adapter = TypeAdapter(QueryJobResultPayload)
+
+
+def media_type(content_type: str) -> str:
+    return content_type.split(";", 1)[0].strip().lower()
+
+
+def decompress_zstd(body: bytes) -> bytes:
+    # Streamed, the node's frames may not record their content size, and read
+    # in chunks so the size limit holds without allocating it up front
+    reader = zstandard.ZstdDecompressor().stream_reader(body, read_across_frames=True)
+    chunks = []
+    size = 0
+    try:
+        while chunk := reader.read(ZSTD_READ_SIZE):
+            size += len(chunk)
+            if size > MAX_CALLBACK_BYTES:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail="Callback body too large",
+                )
+            chunks.append(chunk)
+    except zstandard.ZstdError:
+        raise HTTPException(status_code=400, detail="Invalid zstd body")
+    return b"".join(chunks)
+
+
+def decode_job_result(
+    body: bytes, content_type: str = "", content_encoding: str = ""
+) -> QueryJobResultPayload:
+    """Decodes and validates a result callback body into its wire form dict
+
+    Skips building QueryJobResult models and dumping them back to dicts: the
+    validated dicts are what save_query_result stores. The result is still
+    serialized once more, by the JSON column when it is written.
+    """
+    media = media_type(content_type)
+    encoding = content_encoding.strip().lower()
+    if media not in JSON_TYPES and media not in MSGPACK_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Unsupported content type {media}",
+        )
+    if encoding not in ("", "identity", ZSTD_ENCODING):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Unsupported content encoding {encoding}",
+        )
+
+    label = "msgpack" if media in MSGPACK_TYPES else "json"
+    RESULT_CALLBACK_BYTES.labels(
+        encoding=f"{label}+zstd" if encoding == ZSTD_ENCODING else label
+    ).inc(len(body))
+
+    if encoding == ZSTD_ENCODING:
+        body = decompress_zstd(body)
+
+    try:
+        if media in MSGPACK_TYPES:
+            try:
+                payload = msgpack.unpackb(body)
+            except (ValueError, msgpack.UnpackException):
+                raise HTTPException(status_code=400, detail="Invalid msgpack body")
+            return query_job_result_adapter.validate_python(payload)
+        return query_job_result_adapter.validate_json(body)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=e.errors(include_url=False, include_input=False),
+        )
+
+
+def encode_job_result(payload: dict, encoding: str = "json") -> tuple[bytes, dict]:
+    """Encodes a result callback the way the node does, returns (body, headers)
+
+    `encoding` is one of json, msgpack, json+zstd or msgpack+zstd.
+    """
+    codec, _, compression = encoding.partition("+")
+    if codec == "msgpack":
+        body = msgpack.packb(payload)
+        headers = {"Content-Type": "application/msgpack"}
+    else:
+        body = query_job_result_adapter.dump_json(payload)
+        headers = {"Content-Type": "application/json"}
+    if compression == ZSTD_ENCODING:
+        body = zstandard.ZstdCompressor(level=3).compress(body)
+        headers["Content-Encoding"] = ZSTD_ENCODING
+    return body, headers
@@ -0,0 +1,132 @@
+import glob
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import psycopg2
+import psycopg2.extensions
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import text
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "..", "migrations")
+
+
+def summarize(samples: list[float]) -> dict:
+    """Median, p95, p99 and max of millisecond timings, percentiles by nearest rank"""
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[math.ceil(0.95 * len(samples)) - 1], 3),
+        "p99_ms": round(samples[math.ceil(0.99 * len(samples)) - 1], 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_metadata() -> dict:
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def write_results(results: dict, output: str = None):
+    content = json.dumps(results, indent=2, default=str)
+    if output:
+        with open(output, "w") as f:
+            f.write(content)
+    print(content)
+
+
+def _dsn(url) -> str:
+    return url.set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+def apply_migrations(dsn: str, migrations_dir: str = MIGRATIONS_DIR):
+    """Applies create_table.sql and then the numbered migrations, in order"""
+    files = [os.path.join(migrations_dir, "create_table.sql")] + sorted(
+        glob.glob(os.path.join(migrations_dir, "[0-9]*.sql"))
+    )
+    conn = psycopg2.connect(dsn)
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        with conn.cursor() as cursor:
+            for path in files:
+                with open(path) as f:
+                    cursor.execute(f.read())
+    finally:
+        conn.close()
+
+
+@contextmanager
+def disposable_database(server_url: str, migrations_dir: str = MIGRATIONS_DIR):
+    """Creates a throwaway database with the current schema and drops it afterwards
+
+    `server_url` points at any database of the server the benchmark may use,
+    the throwaway database is created next to it.
+    """
+    url = make_url(server_url)
+    name = f"mizu_bench_{uuid.uuid4().hex[:8]}"
+
+    admin = psycopg2.connect(_dsn(url))
+    admin.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        with admin.cursor() as cursor:
+            cursor.execute(f"CREATE DATABASE {name}")
+        bench_url = url.set(database=name)
+        try:
+            apply_migrations(_dsn(bench_url), migrations_dir)
+            yield bench_url.render_as_string(hide_password=False)
+        finally:
+            with admin.cursor() as cursor:
+                cursor.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+    finally:
+        admin.close()
+
+
+def seed_datasets(name: str, size: int, language: str = "en"):
+    """Inserts `size` synthetic dataset shards under one dataset name"""
+    from app.db.database import get_db_session
+
+    with get_db_session() as session:
+        session.execute(
+            text(
+                """
+                INSERT INTO datasets (
+                    name, language, data_type, r2_key, md5,
+                    decompressed_byte_size, byte_size
+                )
+                SELECT
+                    :name, :language, 'text',
+                    :name || '/text/' || :language || '/' || md5(:name || g) || '.zz',
+                    md5(:name || g),
+                    4000000 + g, 1000000 + g
+                FROM generate_series(1, :size) AS g
+                """
+            ),
+            {"name": name, "language": language, "size": size},
+        )
+        session.execute(text("ANALYZE datasets"))
@@ -0,0 +1,75 @@
+"""Compares two `bench` result files and fails on median regressions.
+
+    poetry run bench-compare base.json head.json --threshold 0.10
+
+Benchmarks are matched by name and params. Exits with status 1 when any
+median got slower than the threshold allows, so it can gate a CI job.
+"""
+
+import argparse
+import json
+import sys
+
+
+def _key(record: dict) -> str:
+    return record["name"] + " " + json.dumps(record.get("params", {}), sort_keys=True)
+
+
+def load(path: str) -> tuple[dict, dict]:
+    with open(path) as f:
+        results = json.load(f)
+    return results, {_key(r): r for r in results.get("benchmarks", [])}
+
+
+def compare(base: dict, head: dict, threshold: float) -> tuple[list, list]:
+    """Returns (rows, regressions), rows are (key, base_ms, head_ms, change)"""
+    rows = []
+    regressions = []
+    for key, head_record in head.items():
+        base_record = base.get(key)
+        if not base_record or "median_ms" not in head_record:
+            rows.append((key, None, head_record.get("median_ms"), None))
+            continue
+        base_ms = base_record["median_ms"]
+        head_ms = head_record["median_ms"]
+        change = (head_ms - base_ms) / base_ms if base_ms else 0.0
+        rows.append((key, base_ms, head_ms, change))
+        if change > threshold:
+            regressions.append(key)
+    return rows, regressions
+
+
+def start():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base", help="Results of the baseline commit")
+    parser.add_argument("head", help="Results of the commit under test")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Allowed median slowdown as a fraction, 0.10 is 10%%",
+    )
+    args = parser.parse_args()
+
+    base_results, base = load(args.base)
+    head_results, head = load(args.head)
+    rows, regressions = compare(base, head, args.threshold)
+
+    print(
+        f"base {base_results.get('commit', 'unknown')[:12]}"
+        f" -> head {head_results.get('commit', 'unknown')[:12]}"
+    )
+    for key, base_ms, head_ms, change in rows:
+        if change is None:
+            print(f"  {'new':<10}{key}: {head_ms} ms")
+            continue
+        flag = "REGRESSED" if key in regressions else "ok"
+        print(f"  {flag:<10}{key}: {base_ms} -> {head_ms} ms ({change:+.1%})")
+
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    start()
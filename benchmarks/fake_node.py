@@ -0,0 +1,202 @@
+import asyncio
+import itertools
+import random
+import time
+import uuid
+from collections import defaultdict
+from typing import Callable
+
+import aiohttp
+from aiohttp import web
+
+from app.wire import encode_job_result
+
+
+class FakeMizuNode:
+    """Stands in for the Mizu node service, assigning job ids to published batches"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.published_jobs = 0
+        self.published_batches = 0
+        self._prefix = uuid.uuid4().hex[:8]
+        self._ids = itertools.count()
+        self._runner = None
+
+        self.app = web.Application(client_max_size=64 * 1024 * 1024)
+        self.app.router.add_post("/publish_batch_classify_job", self.publish)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> str:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # Resolve the port picked by the OS when started on port 0
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def assign_job_ids(self, count: int) -> list[str]:
+        return [f"{self._prefix}-{next(self._ids)}" for _ in range(count)]
+
+    async def publish(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        contexts = payload.get("data", [])
+        ids = self.assign_job_ids(len(contexts))
+        self.published_jobs += len(ids)
+        self.published_batches += 1
+        self.on_jobs(contexts, ids)
+        return web.json_response({"ids": ids})
+
+    def on_jobs(self, contexts: list[dict], ids: list[str]):
+        """Called with every accepted batch, the base node drops the jobs"""
+
+
+class CallbackMizuNode(FakeMizuNode):
+    """Fake node that also "runs" its jobs, calling back /save_query_result
+
+    Jobs are held per query until `release(query_id)`, which the caller does
+    once the publisher committed, then become due after `job_latency`
+    seconds. Callbacks go out at `rate` per second with at most `concurrency`
+    in flight, so a slow API shows up as latency and a falling send rate
+    rather than as a growing pile of open connections.
+
+    Matches per job follow a Pareto distribution of shape `skew`: most jobs
+    match nothing and a few match up to `max_entries`, like real crawls.
+    Results are sent in `encoding`, see app.wire.encode_job_result.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        api_key: str,
+        rate: float,
+        error_ratio: float = 0.0,
+        duplicate_ratio: float = 0.0,
+        skew: float = 1.2,
+        max_entries: int = 200,
+        job_latency: float = 0.0,
+        concurrency: int = 64,
+        encoding: str = "json",
+        on_response: Callable[[str, float, int], None] = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.api_url = api_url.rstrip("/")
+        self.rate = rate
+        self.error_ratio = error_ratio
+        self.duplicate_ratio = duplicate_ratio
+        self.skew = skew
+        self.max_entries = max_entries
+        self.job_latency = job_latency
+        self.encoding = encoding
+        self.on_response = on_response or (lambda name, seconds, status: None)
+        self.callbacks_sent = 0
+        self._headers = {"Authorization": f"Bearer {api_key}"}
+        self._held = defaultdict(list)
+        self._due = asyncio.Queue()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._inflight = set()
+        self._dispatcher = None
+        self._client = None
+
+    async def start(self) -> str:
+        url = await super().start()
+        self._client = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0)
+        )
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        return url
+
+    async def stop(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        if self._client:
+            await self._client.close()
+        await super().stop()
+
+    @property
+    def pending(self) -> int:
+        held = sum(len(ids) for ids in self._held.values())
+        return held + self._due.qsize() + len(self._inflight)
+
+    def on_jobs(self, contexts: list[dict], ids: list[str]):
+        for context, job_id in zip(contexts, ids):
+            self._held[context["classifierId"]].append(job_id)
+
+    def release(self, query_id: int):
+        """Starts running the jobs published for a query"""
+        due_at = time.monotonic() + self.job_latency
+        jobs = self._held.pop(query_id, [])
+        random.shuffle(jobs)
+        for job_id in jobs:
+            self._due.put_nowait((due_at, job_id))
+
+    async def _dispatch(self):
+        # Open loop pacing, sends catch up after a stall instead of drifting
+        interval = 1 / self.rate
+        next_send = time.monotonic()
+        while True:
+            due_at, job_id = await self._due.get()
+            now = time.monotonic()
+            next_send = max(next_send, now, due_at)
+            await asyncio.sleep(next_send - now)
+            next_send += interval
+
+            await self._slots.acquire()
+            task = asyncio.create_task(self._callback(job_id))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+            if random.random() < self.duplicate_ratio:
+                # Redelivery of the same job, like a node retrying after a timeout
+                self._due.put_nowait((0, job_id))
+
+    def job_result(self, job_id: str) -> dict:
+        if random.random() < self.error_ratio:
+            return {
+                "jobId": job_id,
+                "errorResult": {"code": random.choice([404, 500, 503]), "message": "simulated"},
+            }
+        matches = min(self.max_entries, int(random.paretovariate(self.skew)) - 1)
+        return {
+            "jobId": job_id,
+            "batchClassifyResult": [
+                {
+                    # Hosts are skewed too, so facet rows see hot keys
+                    "uri": f"https://host{int(random.paretovariate(self.skew))}.example/{job_id}/{i}",
+                    "text": f"simulated match {i} of job {job_id} " * 4,
+                }
+                for i in range(matches)
+            ],
+        }
+
+    async def _callback(self, job_id: str):
+        try:
+            started = time.perf_counter()
+            status = 0
+            body, headers = encode_job_result(self.job_result(job_id), self.encoding)
+            try:
+                async with self._client.post(
+                    f"{self.api_url}/save_query_result",
+                    data=body,
+                    headers={**self._headers, **headers},
+                ) as response:
+                    await response.read()
+                    status = response.status
+            except aiohttp.ClientError:
+                pass
+            self.callbacks_sent += 1
+            self.on_response("save_query_result", time.perf_counter() - started, status)
+        finally:
+            self._slots.release()
@@ -0,0 +1,319 @@
+"""Microbenchmarks for the publisher, result callback and pagination hot paths.
+
+Every run creates a disposable database next to the given Postgres URL, applies
+the migrations, starts a fake Mizu node and drops the database afterwards:
+
+    BENCH_POSTGRES_URL=postgresql://localhost/postgres poetry run bench \\
+        --sizes 10000 100000 1000000 --output bench-$(git rev-parse --short HEAD).json
+
+Compare two runs with `poetry run bench-compare base.json head.json`.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy.sql import text
+
+from benchmarks.common import (
+    MIGRATIONS_DIR,
+    disposable_database,
+    run_metadata,
+    seed_datasets,
+    summarize,
+    write_results,
+)
+from benchmarks.fake_node import FakeMizuNode
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 1000
+
+
+def result(name: str, params: dict, samples: list[float], items: int = None) -> dict:
+    """One benchmark record, throughput is items per second over all samples"""
+    record = {"name": name, "params": params, **summarize(samples)}
+    if items is not None and samples:
+        record["items_per_sec"] = round(items / (sum(samples) / 1000), 1)
+    return record
+
+
+def register_query(dataset: str) -> int:
+    from app.db.database import get_db_session, save_new_query
+
+    with get_db_session() as session:
+        return save_new_query(
+            session,
+            dataset=dataset,
+            language="en",
+            query_text="benchmark",
+            model="bench",
+            owner="bench",
+        )
+
+
+async def bench_publisher(size: int, node: FakeMizuNode) -> list[dict]:
+    """Times each phase of process_query over a dataset of `size` shards"""
+    from app.db.database import get_async_db_session
+    from app.models import Query
+    from app.publisher import (
+        create_batch_classify_requests,
+        publish_batch_classify_jobs,
+        save_batch_query_results,
+    )
+
+    dataset = f"bench-{size}"
+    seed_datasets(dataset, size)
+    query_id = register_query(dataset)
+
+    create_ms, publish_ms, save_ms = [], [], []
+    async with get_async_db_session() as session:
+        query = await session.get(Query, query_id)
+        batches = create_batch_classify_requests(session, query)
+        while True:
+            started = time.perf_counter()
+            try:
+                batch = await batches.__anext__()
+            except StopAsyncIteration:
+                break
+            create_ms.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            response = await publish_batch_classify_jobs(batch)
+            publish_ms.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            await save_batch_query_results(session, query, response, batch.data)
+            await session.commit()
+            save_ms.append((time.perf_counter() - started) * 1000)
+
+    logger.info(f"Published {size} shards for query {query_id}")
+    params = {"datasets": size}
+    return [
+        result("create_batch_classify_requests", params, create_ms, items=size),
+        result("publish_batch_classify_jobs", params, publish_ms, items=size),
+        result("save_batch_query_results", params, save_ms, items=size),
+    ]
+
+
+def bench_callbacks(query_id: int, callbacks: int, entries: int) -> list[dict]:
+    """Times save_query_result one callback per session, like the endpoint"""
+    from app.db.database import get_db_session, save_query_result
+    from app.models import QueryJob
+
+    with get_db_session() as session:
+        job_ids = [
+            job.job_id
+            for job in session.query(QueryJob)
+            .filter(QueryJob.query_id == query_id)
+            .limit(callbacks)
+        ]
+
+    samples = []
+    for i, job_id in enumerate(job_ids):
+        payload = {
+            "jobId": job_id,
+            "batchClassifyResult": [
+                {
+                    "uri": f"https://host{i % 50}.example/page/{i}/{j}",
+                    "text": f"matched passage {i} {j} " * 8,
+                }
+                for j in range(entries)
+            ],
+        }
+        started = time.perf_counter()
+        with get_db_session() as session:
+            save_query_result(session, payload)
+        samples.append((time.perf_counter() - started) * 1000)
+
+    return [
+        result(
+            "save_query_result",
+            {"entries": entries},
+            samples,
+            items=len(samples),
+        )
+    ]
+
+
+def seed_processed_results(query_id: int, rows: int, entries: int):
+    from app.db.database import get_db_session
+
+    with get_db_session() as session:
+        session.execute(
+            text(
+                """
+                INSERT INTO query_results (query_id, data_id, job_id, result, status, finished_at, completed_seq)
+                SELECT
+                    :query_id, g, 'seeded-' || :query_id || '-' || g,
+                    (
+                        SELECT jsonb_agg(jsonb_build_object(
+                            'uri', 'https://host' || (g % 50) || '.example/' || g || '/' || e,
+                            'text', repeat('matched passage ', 8)
+                        ))
+                        FROM generate_series(1, :entries) AS e
+                    ),
+                    'processed', now(), g
+                FROM generate_series(1, :rows) AS g
+                """
+            ),
+            {"query_id": query_id, "rows": rows, "entries": entries},
+        )
+        session.execute(text("ANALYZE query_results"))
+
+
+def bench_pagination(rows: int, entries: int, repeat: int) -> list[dict]:
+    """Times get_query_results at shallow and deep pages, by offset and by cursor"""
+    from app.db.database import get_db_session, get_query_results
+    from app.models import QueryResult
+
+    query_id = register_query("bench-pagination")
+    seed_processed_results(query_id, rows, entries)
+
+    pages = max(1, rows // PAGE_SIZE)
+    depths = {"first": 1, "middle": max(1, pages // 2), "last": pages}
+    records = []
+    for depth, page in depths.items():
+        with get_db_session() as session:
+            after = (
+                session.query(QueryResult.completed_seq)
+                .filter(QueryResult.query_id == query_id)
+                .order_by(QueryResult.completed_seq)
+                .offset((page - 1) * PAGE_SIZE)
+                .limit(1)
+                .scalar()
+            ) - 1
+
+        for mode in ("offset", "cursor"):
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                with get_db_session() as session:
+                    if mode == "offset":
+                        results, _total, _more = get_query_results(
+                            session, query_id, page
+                        )
+                    else:
+                        results, _total, _more = get_query_results(
+                            session, query_id, after=after
+                        )
+                    len(results)
+                samples.append((time.perf_counter() - started) * 1000)
+            records.append(
+                result(
+                    "get_query_results",
+                    {"rows": rows, "depth": depth, "mode": mode},
+                    samples,
+                )
+            )
+    return records
+
+
+def bench_json_response(entries: int, repeat: int) -> list[dict]:
+    """Times build_json_response on a full results page"""
+    from app.models.service import ClassifyResult, PaginatedQueryResults, QueryResult
+    from app.response import build_ok_response
+
+    page = PaginatedQueryResults(
+        results=[
+            QueryResult(
+                results=[
+                    ClassifyResult(
+                        uri=f"https://host{i % 50}.example/page/{i}/{j}",
+                        text="matched passage " * 8,
+                    )
+                    for j in range(entries)
+                ]
+            )
+            for i in range(PAGE_SIZE)
+        ],
+        total=PAGE_SIZE,
+        page=1,
+        page_size=PAGE_SIZE,
+        has_more=False,
+    )
+
+    samples = []
+    size = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = build_ok_response(page)
+        samples.append((time.perf_counter() - started) * 1000)
+        size = len(response.body)
+
+    return [
+        result(
+            "build_json_response",
+            {"results": PAGE_SIZE, "entries": entries, "bytes": size},
+            samples,
+        )
+    ]
+
+
+async def run_suite(args) -> list[dict]:
+    node = FakeMizuNode()
+    os.environ["MIZU_NODE_SERVICE_URL"] = await node.start()
+    records = []
+    try:
+        for size in args.sizes:
+            records += await bench_publisher(size, node)
+    finally:
+        await node.stop()
+
+    # Callbacks go to the jobs of the smallest published query
+    from app.db.database import get_db_session
+    from app.models import Query
+
+    with get_db_session() as session:
+        query_id = (
+            session.query(Query.id)
+            .filter(Query.dataset == f"bench-{min(args.sizes)}")
+            .scalar()
+        )
+    records += bench_callbacks(query_id, args.callbacks, args.entries)
+    records += bench_pagination(args.result_rows, args.entries, args.repeat)
+    records += bench_json_response(args.entries, args.repeat)
+    return records
+
+
+def start():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--postgres-url",
+        default=os.getenv("BENCH_POSTGRES_URL", os.getenv("POSTGRES_URL")),
+        help="Server to create the disposable benchmark database on",
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument("--callbacks", type=int, default=2000)
+    parser.add_argument(
+        "--entries", type=int, default=20, help="ClassifyResults per job result"
+    )
+    parser.add_argument("--result-rows", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--migrations", default=MIGRATIONS_DIR)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if not args.postgres_url:
+        parser.error("--postgres-url or BENCH_POSTGRES_URL is required")
+
+    metadata = run_metadata()
+    with disposable_database(args.postgres_url, args.migrations) as url:
+        # The app reads its database from the environment at import time
+        os.environ["POSTGRES_URL"] = url
+        records = asyncio.run(run_suite(args))
+
+    write_results({**metadata, "benchmarks": records}, args.output)
+
+
+if __name__ == "__main__":
+    start()
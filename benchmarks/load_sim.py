@@ -0,0 +1,415 @@
+"""End-to-end load simulator against a running API.
+
+Reproduces the production traffic shape on one box. It:
+- seeds a synthetic dataset
+- registers queries through /register_query
+- runs the publisher against a fake Mizu node
+- has the node call back /save_query_result at a set rate, error ratio and
+  skew
+- has simulated clients page /queries/{id}/results and the summary meanwhile
+
+Start the API and the simulator against the same database:
+
+    POSTGRES_URL=... API_SECRET_KEY=... poetry run start
+    POSTGRES_URL=... API_SECRET_KEY=... poetry run load-sim \\
+        --queries 20 --datasets 5000 --callback-rate 2000 --readers 50
+
+It reports sustained throughput and latency percentiles per endpoint, the
+callback outcomes and the saturation of the API's connection pool and of
+Postgres, as JSON.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+from collections import defaultdict
+
+import aiohttp
+import psycopg2
+from prometheus_client.parser import text_string_to_metric_families
+
+from benchmarks.common import run_metadata, seed_datasets, summarize, write_results
+from benchmarks.fake_node import CallbackMizuNode
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+USER = "load-sim"
+
+
+class Recorder:
+    """Latency and status of every request, by endpoint"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def __call__(self, endpoint: str, seconds: float, status: int):
+        self.samples[endpoint].append(seconds * 1000)
+        self.statuses[endpoint][status] += 1
+
+    def report(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            endpoint: {
+                "throughput_per_sec": round(len(samples) / elapsed, 2),
+                "statuses": dict(self.statuses[endpoint]),
+                **summarize(samples),
+            }
+            for endpoint, samples in sorted(self.samples.items())
+        }
+
+
+class SaturationSampler:
+    """Polls the API pool metrics and pg_stat_activity while the load runs"""
+
+    def __init__(self, api_url: str, dsn: str, interval: float):
+        self.api_url = api_url
+        self.dsn = dsn
+        self.interval = interval
+        self.checked_out = []
+        self.checkout_wait_ms = []
+        self.pg_connections = []
+        self.pg_active = []
+        self.pg_waiting = []
+        self.max_connections = None
+        self.callbacks = {}
+        self._first_callbacks = None
+
+    async def scrape(self, client: aiohttp.ClientSession) -> dict:
+        async with client.get(f"{self.api_url}/metrics") as response:
+            content = await response.text()
+        values = {}
+        for family in text_string_to_metric_families(content):
+            for sample in family.samples:
+                if sample.name == "result_callbacks_total":
+                    key = f"callbacks:{sample.labels['outcome']}"
+                    values[key] = values.get(key, 0) + sample.value
+                elif sample.name in (
+                    "db_pool_checked_out_connections",
+                    "db_pool_checkout_wait_seconds_sum",
+                    "db_pool_checkout_wait_seconds_count",
+                ):
+                    values[sample.name] = values.get(sample.name, 0) + sample.value
+        return values
+
+    def pg_activity(self) -> tuple:
+        conn = psycopg2.connect(self.dsn)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT
+                        count(*),
+                        count(*) FILTER (WHERE state = 'active'),
+                        count(*) FILTER (WHERE wait_event_type = 'Lock'),
+                        current_setting('max_connections')::int
+                    FROM pg_stat_activity
+                    WHERE datname = current_database() AND pid <> pg_backend_pid()
+                    """
+                )
+                return cursor.fetchone()
+        finally:
+            conn.close()
+
+    async def run(self, stopped: asyncio.Event):
+        previous = None
+        async with aiohttp.ClientSession() as client:
+            while True:
+                values = await self.scrape(client)
+                if self._first_callbacks is None:
+                    self._first_callbacks = values
+                self.checked_out.append(values.get("db_pool_checked_out_connections", 0))
+                if previous is not None:
+                    count = values.get("db_pool_checkout_wait_seconds_count", 0) - previous.get(
+                        "db_pool_checkout_wait_seconds_count", 0
+                    )
+                    total = values.get("db_pool_checkout_wait_seconds_sum", 0) - previous.get(
+                        "db_pool_checkout_wait_seconds_sum", 0
+                    )
+                    if count:
+                        self.checkout_wait_ms.append(total / count * 1000)
+                previous = values
+                self.callbacks = {
+                    key.split(":", 1)[1]: int(value - self._first_callbacks.get(key, 0))
+                    for key, value in values.items()
+                    if key.startswith("callbacks:")
+                }
+
+                total, active, waiting, self.max_connections = await asyncio.to_thread(
+                    self.pg_activity
+                )
+                self.pg_connections.append(total)
+                self.pg_active.append(active)
+                self.pg_waiting.append(waiting)
+
+                if stopped.is_set():
+                    return
+                try:
+                    await asyncio.wait_for(stopped.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def report(self) -> dict:
+        def stats(values: list) -> dict:
+            if not values:
+                return {}
+            return {
+                "mean": round(sum(values) / len(values), 2),
+                "max": round(max(values), 2),
+            }
+
+        return {
+            "api_pool_checked_out": stats(self.checked_out),
+            "api_pool_checkout_wait_ms": stats(self.checkout_wait_ms),
+            "pg_connections": stats(self.pg_connections),
+            "pg_active": stats(self.pg_active),
+            "pg_lock_waits": stats(self.pg_waiting),
+            "pg_max_connections": self.max_connections,
+        }
+
+
+async def timed(client, recorder, endpoint: str, method: str, url: str, **kwargs):
+    started = time.perf_counter()
+    status, body = 0, None
+    try:
+        async with client.request(method, url, **kwargs) as response:
+            status = response.status
+            body = await response.json(content_type=None)
+    except aiohttp.ClientError:
+        pass
+    recorder(endpoint, time.perf_counter() - started, status)
+    return status, body
+
+
+async def publish(query_id: int, node: CallbackMizuNode, recorder: Recorder):
+    """Runs the publisher for one query, like the publish worker would"""
+    from app.publisher import publish_query
+
+    started = time.perf_counter()
+    await publish_query(query_id)
+    recorder("publish_query", time.perf_counter() - started, 200)
+    node.release(query_id)
+
+
+async def register_queries(args, client, recorder, node, dataset, query_ids, publishers):
+    headers = {"Authorization": f"Bearer {args.api_key}"}
+    for i in range(args.queries):
+        status, body = await timed(
+            client,
+            recorder,
+            "register_query",
+            "POST",
+            f"{args.api_url}/register_query",
+            json={
+                "dataset": dataset,
+                "language": "en",
+                "queryText": f"simulated query {i}",
+                "model": "load-sim",
+                "user": USER,
+            },
+            headers=headers,
+        )
+        if status != 200:
+            logger.error(f"register_query failed with {status}: {body}")
+        else:
+            query_id = body["data"]["queryId"]
+            query_ids.append(query_id)
+            publishers.append(asyncio.create_task(publish(query_id, node, recorder)))
+        await asyncio.sleep(args.query_interval)
+
+
+async def read_results(args, client, recorder, query_ids, stopped: asyncio.Event):
+    """One simulated client, walking the pages of random queries"""
+    headers = {"Authorization": f"Bearer {args.api_key}"}
+    while not stopped.is_set():
+        if not query_ids:
+            await asyncio.sleep(0.1)
+            continue
+        query_id = random.choice(query_ids)
+        page = 1
+        while not stopped.is_set():
+            status, body = await timed(
+                client,
+                recorder,
+                "query_results",
+                "GET",
+                f"{args.api_url}/queries/{query_id}/results",
+                params={"user": USER, "page": page},
+                headers=headers,
+            )
+            await asyncio.sleep(args.read_interval)
+            if status != 200 or not body["data"].get("has_more"):
+                break
+            page += 1
+
+        await timed(
+            client,
+            recorder,
+            "query_summary",
+            "GET",
+            f"{args.api_url}/queries/{query_id}/summary",
+            params={"user": USER},
+            headers=headers,
+        )
+        await asyncio.sleep(args.read_interval)
+
+
+async def cleanup(args, dataset: str, query_ids: list[int]):
+    from sqlalchemy.sql import text
+
+    from app.db.database import get_db_session
+
+    headers = {"Authorization": f"Bearer {args.api_key}"}
+    async with aiohttp.ClientSession() as client:
+        for query_id in query_ids:
+            async with client.delete(
+                f"{args.api_url}/queries/{query_id}",
+                params={"user": USER},
+                headers=headers,
+            ) as response:
+                if response.status != 200:
+                    logger.warning(f"Failed to delete query {query_id}: {response.status}")
+    with get_db_session() as session:
+        session.execute(text("DELETE FROM datasets WHERE name = :name"), {"name": dataset})
+
+
+async def simulate(args) -> dict:
+    dataset = f"load-sim-{uuid.uuid4().hex[:8]}"
+    seed_datasets(dataset, args.datasets)
+    logger.info(f"Seeded {args.datasets} shards as dataset {dataset}")
+
+    recorder = Recorder()
+    node = CallbackMizuNode(
+        api_url=args.api_url,
+        api_key=args.api_key,
+        rate=args.callback_rate,
+        error_ratio=args.error_ratio,
+        duplicate_ratio=args.duplicate_ratio,
+        skew=args.skew,
+        max_entries=args.max_entries,
+        job_latency=args.job_latency,
+        concurrency=args.callback_concurrency,
+        encoding=args.callback_encoding,
+        on_response=recorder,
+    )
+    os.environ["MIZU_NODE_SERVICE_URL"] = await node.start()
+
+    from sqlalchemy.engine import make_url
+
+    dsn = make_url(os.environ["POSTGRES_URL"]).render_as_string(hide_password=False)
+    sampler = SaturationSampler(args.api_url, dsn, args.sample_interval)
+    stopped = asyncio.Event()
+    query_ids, publishers = [], []
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as client:
+        sampling = asyncio.create_task(sampler.run(stopped))
+        readers = [
+            asyncio.create_task(read_results(args, client, recorder, query_ids, stopped))
+            for _ in range(args.readers)
+        ]
+        started = time.monotonic()
+        try:
+            await register_queries(
+                args, client, recorder, node, dataset, query_ids, publishers
+            )
+            await asyncio.gather(*publishers)
+
+            # Run until every callback went out, or out of time
+            deadline = started + args.duration
+            while node.pending and time.monotonic() < deadline:
+                await asyncio.sleep(1)
+                logger.info(
+                    f"{node.callbacks_sent}/{node.published_jobs} callbacks sent,"
+                    f" {node.pending} pending"
+                )
+        finally:
+            elapsed = time.monotonic() - started
+            stopped.set()
+            await asyncio.gather(*readers, sampling, return_exceptions=True)
+            await node.stop()
+
+    if not args.keep:
+        await cleanup(args, dataset, query_ids)
+
+    from app.db.database import dispose_engines
+
+    # The async pool is bound to this event loop
+    await dispose_engines()
+
+    return {
+        **run_metadata(),
+        "benchmark": "load_sim",
+        "config": {k: v for k, v in vars(args).items() if k != "api_key"},
+        "elapsed_sec": round(elapsed, 1),
+        "published_jobs": node.published_jobs,
+        "published_batches": node.published_batches,
+        "callbacks_sent": node.callbacks_sent,
+        "callback_outcomes": sampler.callbacks,
+        "endpoints": recorder.report(),
+        "saturation": sampler.report(),
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--api-url", default=os.getenv("LOAD_SIM_API_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--api-key", default=os.getenv("API_SECRET_KEY"))
+    parser.add_argument("--queries", type=int, default=10)
+    parser.add_argument(
+        "--query-interval", type=float, default=1.0, help="Seconds between registrations"
+    )
+    parser.add_argument("--datasets", type=int, default=5000, help="Shards per query")
+    parser.add_argument("--callback-rate", type=float, default=1000, help="Callbacks per second")
+    parser.add_argument("--callback-concurrency", type=int, default=64)
+    parser.add_argument(
+        "--callback-encoding",
+        choices=["json", "json+zstd", "msgpack", "msgpack+zstd"],
+        default="json",
+    )
+    parser.add_argument("--error-ratio", type=float, default=0.02)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.01)
+    parser.add_argument(
+        "--skew", type=float, default=1.2, help="Pareto shape of matches per job, lower is more skewed"
+    )
+    parser.add_argument("--max-entries", type=int, default=200)
+    parser.add_argument(
+        "--job-latency", type=float, default=1.0, help="Seconds from publish to first callback"
+    )
+    parser.add_argument("--readers", type=int, default=20)
+    parser.add_argument(
+        "--read-interval", type=float, default=0.5, help="Client think time between requests"
+    )
+    parser.add_argument("--duration", type=float, default=600, help="Upper bound in seconds")
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--keep", action="store_true", help="Keep the simulated queries")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    return parser
+
+
+def check_args(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    if not args.api_key:
+        parser.error("--api-key or API_SECRET_KEY is required")
+    if "POSTGRES_URL" not in os.environ:
+        parser.error("POSTGRES_URL must point at the database of the API under test")
+
+
+def start():
+    parser = build_parser()
+    args = parser.parse_args()
+    check_args(parser, args)
+    write_results(asyncio.run(simulate(args)), args.output)
+
+
+if __name__ == "__main__":
+    start()
@@ -0,0 +1,156 @@
+"""Search latency benchmark over a synthetic query with many result entries.
+
+Seeds a throwaway query with N entries (1M by default) directly in SQL, then
+times `search_query_results` for rare, common and uri lookups at the first
+page and after paging deep into the hits. Run against a disposable database:
+
+    POSTGRES_URL=postgresql://localhost/mizu_bench poetry run bench-search --entries 1000000
+"""
+
+import argparse
+import logging
+import time
+
+from sqlalchemy.sql import text
+
+from app.db.database import (
+    create_query_partitions,
+    delete_query,
+    drop_query_partitions,
+    get_db_session,
+    search_query_results,
+)
+from benchmarks.common import run_metadata, summarize, write_results
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+VOCABULARY = [
+    "crawl", "market", "weather", "football", "recipe", "science", "travel",
+    "music", "finance", "health", "policy", "energy", "history", "garden",
+    "software", "cinema", "ocean", "mountain", "election", "museum",
+]
+ENTRIES_PER_RESULT = 100
+RARE_TERM = "zeppelin"
+RARE_EVERY = 100000
+
+# (name, mode, term)
+CASES = [
+    ("text_rare", "text", RARE_TERM),
+    ("text_common", "text", "weather"),
+    ("text_phrase", "text", '"weather football"'),
+    ("text_and", "text", "music energy"),
+    ("uri_host", "uri", "host7.example"),
+    ("uri_path", "uri", "/page/4242"),
+]
+
+
+def seed_entries(entries: int) -> int:
+    """Creates a query with `entries` synthetic result entries and returns its id"""
+    with get_db_session() as session:
+        query_id = session.execute(
+            text(
+                """
+                INSERT INTO queries (dataset, language, query_text, model, owner, status)
+                VALUES ('bench', 'en', 'search benchmark', 'bench', 'bench', 'published')
+                RETURNING id
+                """
+            )
+        ).scalar()
+    create_query_partitions(query_id)
+
+    vocabulary = "ARRAY[" + ", ".join(f"'{w}'" for w in VOCABULARY) + "]"
+    size = len(VOCABULARY)
+    chunk = 100000
+    for start in range(0, entries, chunk):
+        stop = min(start + chunk, entries)
+        with get_db_session() as session:
+            session.execute(
+                text(
+                    f"""
+                    INSERT INTO query_result_entries (query_id, result_id, uri, text)
+                    SELECT
+                        :query_id,
+                        g / {ENTRIES_PER_RESULT},
+                        'https://host' || (g % 1000) || '.example/page/' || g,
+                        concat_ws(
+                            ' ',
+                            ({vocabulary})[1 + (g * 7) % {size}],
+                            ({vocabulary})[1 + (g * 13) % {size}],
+                            ({vocabulary})[1 + (g * 31) % {size}],
+                            md5(g::text),
+                            CASE WHEN g % {RARE_EVERY} = 0 THEN '{RARE_TERM}' END
+                        )
+                    FROM generate_series(:start, :stop - 1) AS g
+                    """
+                ),
+                {"query_id": query_id, "start": start, "stop": stop},
+            )
+        logger.info(f"Seeded {stop}/{entries} entries")
+
+    with get_db_session() as session:
+        session.execute(text("ANALYZE query_result_entries"))
+    return query_id
+
+
+def time_search(query_id: int, mode: str, term: str, pages: int, repeat: int) -> dict:
+    first_page = []
+    deep_page = []
+    for _ in range(repeat):
+        after = None
+        for page in range(pages):
+            with get_db_session() as session:
+                started = time.perf_counter()
+                hits, has_more = search_query_results(
+                    session, query_id, term, mode=mode, after=after
+                )
+                elapsed = (time.perf_counter() - started) * 1000
+                after = hits[-1].id if has_more else None
+            (first_page if page == 0 else deep_page).append(elapsed)
+            if after is None:
+                break
+
+    return {"first_page": summarize(first_page), "deep_pages": summarize(deep_page)}
+
+
+def cleanup(query_id: int):
+    drop_query_partitions(query_id)
+    with get_db_session() as session:
+        delete_query(session, query_id)
+
+
+def start():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=1000000)
+    parser.add_argument("--pages", type=int, default=20, help="Pages walked per case")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the seeded query for inspection"
+    )
+    args = parser.parse_args()
+
+    query_id = seed_entries(args.entries)
+    try:
+        results = {
+            **run_metadata(),
+            "benchmark": "search",
+            "entries": args.entries,
+            "cases": {
+                name: time_search(query_id, mode, term, args.pages, args.repeat)
+                for name, mode, term in CASES
+            },
+        }
+    finally:
+        if not args.keep:
+            cleanup(query_id)
+
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    start()
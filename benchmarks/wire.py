@@ -0,0 +1,121 @@
+"""CPU cost of decoding result callbacks per wire encoding.
+
+Times what /save_query_result does with a body before touching the database:
+decode, validate and serialize the results for the JSONB column. The
+`legacy_json` path is the QueryJobResult parse and model_dump the endpoint
+did before it took app.wire payloads:
+
+    poetry run bench-wire --entries 10 100 1000 --output wire.json
+
+CPU is process time, reported per MB of the JSON form of the payload so the
+encodings compare on the same data. Needs no database.
+"""
+
+import argparse
+import json
+import logging
+import random
+import time
+
+from app.models.service import QueryJobResult
+from app.wire import decode_job_result, encode_job_result
+from benchmarks.common import run_metadata, summarize, write_results
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+ENCODINGS = ["json", "json+zstd", "msgpack", "msgpack+zstd"]
+
+
+def job_result(entries: int, text_bytes: int) -> dict:
+    rng = random.Random(entries)
+    words = ["crawl", "match", "passage", "query", "result", "shard", "token"]
+    return {
+        "jobId": f"bench-{entries}",
+        "batchClassifyResult": [
+            {
+                "uri": f"https://host{rng.randrange(50)}.example/page/{i}",
+                "text": " ".join(rng.choices(words, k=text_bytes // 6))[:text_bytes],
+            }
+            for i in range(entries)
+        ],
+    }
+
+
+def legacy_json(body: bytes, headers: dict) -> str:
+    result = QueryJobResult.model_validate_json(body)
+    return json.dumps([r.model_dump() for r in result.batch_classify_result])
+
+
+def wire(body: bytes, headers: dict) -> str:
+    result = decode_job_result(
+        body, headers["Content-Type"], headers.get("Content-Encoding", "")
+    )
+    return json.dumps(result["batchClassifyResult"])
+
+
+def cpu_ms(decode, body: bytes, headers: dict, iterations: int) -> list[float]:
+    samples = []
+    for _ in range(iterations):
+        started = time.process_time()
+        decode(body, headers)
+        samples.append((time.process_time() - started) * 1000)
+    return samples
+
+
+def bench_payload(entries: int, text_bytes: int, iterations: int) -> list[dict]:
+    payload = job_result(entries, text_bytes)
+    json_mb = len(json.dumps(payload).encode()) / (1024 * 1024)
+
+    cases = [("legacy_json", legacy_json, *encode_job_result(payload, "json"))]
+    cases += [(encoding, wire, *encode_job_result(payload, encoding)) for encoding in ENCODINGS]
+
+    records = []
+    for encoding, decode, body, headers in cases:
+        samples = cpu_ms(decode, body, headers, iterations)
+        stats = summarize(samples)
+        records.append(
+            {
+                "name": "decode_job_result",
+                "params": {"entries": entries, "text_bytes": text_bytes, "encoding": encoding},
+                **stats,
+                "wire_bytes": len(body),
+                "json_bytes": round(json_mb * 1024 * 1024),
+                "cpu_ms_per_mb": round(stats["median_ms"] / json_mb, 2),
+            }
+        )
+
+    baseline = records[0]["cpu_ms_per_mb"]
+    for record in records:
+        record["speedup"] = round(baseline / record["cpu_ms_per_mb"], 2)
+        logger.info(
+            f"{entries:>6} entries {record['params']['encoding']:<13}"
+            f" {record['wire_bytes']:>10} bytes {record['cpu_ms_per_mb']:>8} CPU ms/MB"
+            f" ({record['speedup']}x)"
+        )
+    return records
+
+
+def start():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--entries", type=int, nargs="+", default=[10, 100, 1000, 10000],
+        help="ClassifyResults per callback",
+    )
+    parser.add_argument("--text-bytes", type=int, default=200, help="Text size per entry")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    benchmarks = []
+    for entries in args.entries:
+        benchmarks += bench_payload(entries, args.text_bytes, args.iterations)
+    write_results({**run_metadata(), "benchmarks": benchmarks}, args.output)
+
+
+if __name__ == "__main__":
+    start()
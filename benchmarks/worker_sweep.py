@@ -0,0 +1,129 @@
+"""Runs the load simulator against the production server at several worker counts.
+
+Starts `poetry run start` with WEB_CONCURRENCY set to each of --workers in
+turn, runs the same simulated load against it, stops it with SIGTERM and
+tabulates throughput, latency and pool saturation per worker count:
+
+    POSTGRES_URL=... API_SECRET_KEY=... poetry run worker-sweep \\
+        --workers 1 2 4 8 16 32 --queries 20 --callback-rate 5000 --readers 100
+
+Any load-sim option can be passed. Pick the smallest worker count past which
+callback throughput stops growing, and check pg_connections stays well under
+max_connections there.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+from benchmarks.common import run_metadata, write_results
+from benchmarks.load_sim import build_parser, check_args, simulate
+
+logger = logging.getLogger(__name__)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_healthy(url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as client:
+        while time.monotonic() < deadline:
+            try:
+                async with client.get(f"{url}/health") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"Server at {url} did not become healthy")
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "WEB_CONCURRENCY": str(workers),
+        "HOST": "127.0.0.1",
+        "PORT": str(port),
+    }
+    # A fresh metrics directory per run, start() creates one when unset
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    return subprocess.Popen(
+        [sys.executable, "-c", "from app.main import start; start()"], env=env
+    )
+
+
+def stop_server(server: subprocess.Popen) -> float:
+    """Stops the server like an orchestrator would, returns the shutdown time"""
+    started = time.monotonic()
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+    return time.monotonic() - started
+
+
+def row(workers: int, result: dict, shutdown: float) -> dict:
+    endpoints = result["endpoints"]
+    callbacks = endpoints.get("save_query_result", {})
+    reads = endpoints.get("query_results", {})
+    saturation = result["saturation"]
+    return {
+        "workers": workers,
+        "callbacks_per_sec": callbacks.get("throughput_per_sec"),
+        "callback_p95_ms": callbacks.get("p95_ms"),
+        "reads_per_sec": reads.get("throughput_per_sec"),
+        "read_p95_ms": reads.get("p95_ms"),
+        "pool_wait_ms_max": saturation["api_pool_checkout_wait_ms"].get("max"),
+        "pg_connections_max": saturation["pg_connections"].get("max"),
+        "shutdown_sec": round(shutdown, 1),
+    }
+
+
+def start():
+    parser = build_parser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    args = parser.parse_args()
+    check_args(parser, args)
+
+    rows, runs = [], []
+    for workers in args.workers:
+        port = free_port()
+        args.api_url = f"http://127.0.0.1:{port}"
+        server = start_server(workers, port)
+        try:
+            asyncio.run(wait_healthy(args.api_url, args.startup_timeout))
+            logger.info(f"Running the simulation against {workers} worker(s)")
+            result = asyncio.run(simulate(args))
+        finally:
+            shutdown = stop_server(server)
+        runs.append(result)
+        rows.append(row(workers, result, shutdown))
+
+    for r in rows:
+        logger.info(
+            f"{r['workers']:>3} workers: {r['callbacks_per_sec']} callbacks/s"
+            f" (p95 {r['callback_p95_ms']} ms), {r['reads_per_sec']} reads/s"
+            f" (p95 {r['read_p95_ms']} ms), {r['pg_connections_max']} connections"
+        )
+    write_results(
+        {**run_metadata(), "benchmark": "worker_sweep", "sweep": rows, "runs": runs},
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    start()
@@ -0,0 +1,58 @@
+-- Per-query summary counters, updated incrementally by the result callback
+CREATE TABLE IF NOT EXISTS query_summaries (
+    query_id INTEGER PRIMARY KEY REFERENCES queries(id) ON DELETE CASCADE,
+    published INTEGER NOT NULL DEFAULT 0,
+    processed INTEGER NOT NULL DEFAULT 0,
+    errored INTEGER NOT NULL DEFAULT 0,
+    matches BIGINT NOT NULL DEFAULT 0,
+    last_cursor BIGINT,
+    -- Bumped by every update, orders snapshots and progress events
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Per-query facet histograms (error codes, result hosts)
+CREATE TABLE IF NOT EXISTS query_facet_counts (
+    query_id INTEGER NOT NULL REFERENCES queries(id) ON DELETE CASCADE,
+    facet VARCHAR(20) NOT NULL,
+    value VARCHAR(255) NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (query_id, facet, value)
+);
+
+CREATE INDEX IF NOT EXISTS idx_query_facet_counts_top
+    ON query_facet_counts(query_id, facet, count DESC);
+
+-- Backfill from results saved before the summaries existed
+INSERT INTO query_summaries (query_id, published, processed, errored, matches, last_cursor)
+SELECT
+    query_id,
+    COUNT(*),
+    COUNT(*) FILTER (WHERE status = 'processed'),
+    COUNT(*) FILTER (WHERE status = 'error'),
+    COALESCE(SUM(jsonb_array_length(result)) FILTER (
+        WHERE status = 'processed' AND jsonb_typeof(result) = 'array'
+    ), 0),
+    MAX(id) FILTER (WHERE status = 'processed')
+FROM query_results
+GROUP BY query_id
+ON CONFLICT (query_id) DO NOTHING;
+
+INSERT INTO query_facet_counts (query_id, facet, value, count)
+SELECT query_id, 'error_code', result->>'code', COUNT(*)
+FROM query_results
+WHERE status = 'error' AND result ? 'code'
+GROUP BY query_id, result->>'code'
+ON CONFLICT (query_id, facet, value) DO NOTHING;
+
+INSERT INTO query_facet_counts (query_id, facet, value, count)
+SELECT
+    qr.query_id,
+    'host',
+    LEFT(COALESCE(LOWER(SUBSTRING(entry->>'uri' FROM '^[A-Za-z][A-Za-z0-9+.-]*://(?:[^@/?#]*@)?([^:/?#]+)')), ''), 255),
+    COUNT(*)
+FROM query_results qr
+CROSS JOIN LATERAL jsonb_array_elements(qr.result) AS entry
+WHERE qr.status = 'processed' AND jsonb_typeof(qr.result) = 'array'
+GROUP BY 1, 3
+ON CONFLICT (query_id, facet, value) DO NOTHING;
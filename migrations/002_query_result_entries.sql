@@ -0,0 +1,30 @@
+-- Search index over the ClassifyResult entries of each query
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+CREATE TABLE IF NOT EXISTS query_result_entries (
+    id BIGSERIAL PRIMARY KEY,
+    query_id INTEGER NOT NULL REFERENCES queries(id) ON DELETE CASCADE,
+    result_id INTEGER NOT NULL,
+    uri TEXT NOT NULL,
+    text TEXT NOT NULL,
+    search_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', left(text, 100000))) STORED
+);
+
+-- btree_gin lets the query_id equality share the GIN index with the search term
+CREATE INDEX IF NOT EXISTS idx_query_result_entries_search
+    ON query_result_entries USING GIN (query_id, search_vector);
+CREATE INDEX IF NOT EXISTS idx_query_result_entries_uri_trgm
+    ON query_result_entries USING GIN (query_id, uri gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_query_result_entries_query_id
+    ON query_result_entries(query_id, id);
+
+-- Backfill from results saved before the index existed, on first run only
+INSERT INTO query_result_entries (query_id, result_id, uri, text)
+SELECT qr.query_id, qr.id, COALESCE(entry->>'uri', ''), COALESCE(entry->>'text', '')
+FROM query_results qr
+CROSS JOIN LATERAL jsonb_array_elements(qr.result) WITH ORDINALITY AS e(entry, position)
+WHERE qr.status = 'processed'
+  AND jsonb_typeof(qr.result) = 'array'
+  AND NOT EXISTS (SELECT 1 FROM query_result_entries)
+ORDER BY qr.id, e.position;
@@ -0,0 +1,159 @@
+-- Partition query_results and query_result_entries by query, one partition per query.
+--
+-- Dropping a query detaches and drops its partitions instead of deleting rows one
+-- by one, and every per-query scan is pruned to a single partition. Because
+-- job_id can no longer be unique across partitions, query_jobs routes result
+-- callbacks (which only carry the job id) to their query.
+--
+-- Lock sizing: a query's two partitions come to 15 relations with their
+-- indexes and TOAST tables, and a statement Postgres cannot prune to one query
+-- locks those of every query. The shared lock table holds about
+-- max_locks_per_transaction * (max_connections + max_prepared_transactions)
+-- locks, 6400 with the defaults, so such a statement fails with "out of shared
+-- memory" at a few hundred queries. Every statement on these tables must
+-- filter on query_id = <value>, tests/test_partitions.py checks the code.
+-- Statements that must touch every partition, like an ALTER TABLE of the
+-- parent in a later migration, need max_locks_per_transaction of at least
+-- 15 * queries / (max_connections + max_prepared_transactions).
+--
+-- The tables are swapped in one transaction, then migrate_legacy_query_results
+-- creates and fills the partitions of one query per transaction. Each partition
+-- comes with its indexes and TOAST table, so doing every query at once would
+-- hold more relation locks than max_locks_per_transaction allows. Apply it with
+-- psql -f, outside a transaction (not --single-transaction), so the procedure
+-- can commit. Run it during a maintenance window: callbacks of existing queries
+-- fail until their rows are copied. If the copy is interrupted, run the CALL
+-- and the statements after it again, rows already copied are skipped.
+
+BEGIN;
+
+-- Creates the partitions of a query if they do not exist yet. Partitions are
+-- created standalone and then attached, which takes a SHARE UPDATE EXCLUSIVE
+-- lock on the parent, so concurrent callbacks are not blocked. Attaching also
+-- clones the foreign key to queries, which takes SHARE ROW EXCLUSIVE on
+-- queries and waits for transactions writing to it, see create_query_partitions.
+CREATE OR REPLACE FUNCTION create_query_partitions(p_query_id INTEGER) RETURNS VOID AS $$
+DECLARE
+    parent TEXT;
+    partition TEXT;
+BEGIN
+    FOREACH parent IN ARRAY ARRAY['query_results', 'query_result_entries'] LOOP
+        partition := format('%s_q%s', parent, p_query_id);
+        IF to_regclass(partition) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)',
+                partition, parent
+            );
+            EXECUTE format(
+                'ALTER TABLE %I ATTACH PARTITION %I FOR VALUES IN (%s)',
+                parent, partition, p_query_id
+            );
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- query_results
+ALTER TABLE query_results RENAME TO query_results_legacy;
+ALTER INDEX idx_query_results_query_id RENAME TO idx_query_results_legacy_query_id;
+ALTER INDEX idx_query_results_job_id RENAME TO idx_query_results_legacy_job_id;
+ALTER INDEX idx_query_results_status RENAME TO idx_query_results_legacy_status;
+ALTER INDEX idx_query_results_created_at RENAME TO idx_query_results_legacy_created_at;
+-- Keep the id sequence alive when the legacy table is dropped
+ALTER SEQUENCE query_results_id_seq OWNED BY NONE;
+
+CREATE TABLE query_results (
+    id INTEGER NOT NULL DEFAULT nextval('query_results_id_seq'),
+    query_id INTEGER NOT NULL REFERENCES queries(id) ON DELETE CASCADE,
+    data_id INTEGER NOT NULL,
+    job_id VARCHAR(255) NOT NULL,
+    result JSONB,
+    status VARCHAR(20) DEFAULT 'pending' CHECK (status IN ('pending', 'processed', 'error')),
+    finished_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, query_id)
+) PARTITION BY LIST (query_id);
+
+ALTER SEQUENCE query_results_id_seq OWNED BY query_results.id;
+
+CREATE INDEX idx_query_results_job_id ON query_results(job_id);
+CREATE INDEX idx_query_results_status ON query_results(status);
+CREATE INDEX idx_query_results_created_at ON query_results(created_at);
+
+-- Routes result callbacks to the partition of their query. No foreign key to
+-- queries: a cascade would make deleting a query one bulk DELETE over its
+-- jobs, so the rows of deleted and archived queries are pruned in small
+-- batches by prune_query_jobs instead. Callbacks for them fail their join to
+-- queries in the meantime.
+CREATE TABLE IF NOT EXISTS query_jobs (
+    job_id VARCHAR(255) PRIMARY KEY,
+    query_id INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_query_jobs_query_id ON query_jobs(query_id);
+
+-- query_result_entries
+ALTER TABLE query_result_entries RENAME TO query_result_entries_legacy;
+ALTER INDEX idx_query_result_entries_search RENAME TO idx_query_result_entries_legacy_search;
+ALTER INDEX idx_query_result_entries_uri_trgm RENAME TO idx_query_result_entries_legacy_uri_trgm;
+ALTER INDEX idx_query_result_entries_query_id RENAME TO idx_query_result_entries_legacy_query_id;
+ALTER SEQUENCE query_result_entries_id_seq OWNED BY NONE;
+
+CREATE TABLE query_result_entries (
+    id BIGINT NOT NULL DEFAULT nextval('query_result_entries_id_seq'),
+    query_id INTEGER NOT NULL REFERENCES queries(id) ON DELETE CASCADE,
+    result_id INTEGER NOT NULL,
+    uri TEXT NOT NULL,
+    text TEXT NOT NULL,
+    search_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', left(text, 100000))) STORED,
+    PRIMARY KEY (id, query_id)
+) PARTITION BY LIST (query_id);
+
+ALTER SEQUENCE query_result_entries_id_seq OWNED BY query_result_entries.id;
+
+CREATE INDEX idx_query_result_entries_search
+    ON query_result_entries USING GIN (query_id, search_vector);
+CREATE INDEX idx_query_result_entries_uri_trgm
+    ON query_result_entries USING GIN (query_id, uri gin_trgm_ops);
+CREATE INDEX idx_query_result_entries_query_id
+    ON query_result_entries(query_id, id);
+
+COMMIT;
+
+-- Partitions for every existing query and its rows, one query per transaction
+CREATE OR REPLACE PROCEDURE migrate_legacy_query_results() AS $$
+DECLARE
+    q INTEGER;
+BEGIN
+    FOR q IN SELECT id FROM queries ORDER BY id LOOP
+        PERFORM create_query_partitions(q);
+
+        INSERT INTO query_results (id, query_id, data_id, job_id, result, status, finished_at, created_at)
+        SELECT id, query_id, data_id, job_id, result, status, finished_at, created_at
+        FROM query_results_legacy
+        WHERE query_id = q
+        ON CONFLICT (id, query_id) DO NOTHING;
+
+        INSERT INTO query_jobs (job_id, query_id)
+        SELECT job_id, query_id FROM query_results_legacy
+        WHERE query_id = q
+        ON CONFLICT (job_id) DO NOTHING;
+
+        INSERT INTO query_result_entries (id, query_id, result_id, uri, text)
+        SELECT id, query_id, result_id, uri, text
+        FROM query_result_entries_legacy
+        WHERE query_id = q
+        ON CONFLICT (id, query_id) DO NOTHING;
+
+        COMMIT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CALL migrate_legacy_query_results();
+
+BEGIN;
+DROP PROCEDURE migrate_legacy_query_results();
+DROP TABLE query_results_legacy;
+DROP TABLE query_result_entries_legacy;
+COMMIT;
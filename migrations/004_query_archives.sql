@@ -0,0 +1,15 @@
+-- Archived queries keep their summary, their results move to compressed files
+CREATE TABLE IF NOT EXISTS query_archives (
+    query_id INTEGER PRIMARY KEY REFERENCES queries(id) ON DELETE CASCADE,
+    location TEXT NOT NULL,
+    codec VARCHAR(20) NOT NULL,
+    jobs INTEGER NOT NULL,
+    byte_size BIGINT NOT NULL,
+    -- Byte ranges of the archive's frames, see app.archive.write_archive_file
+    frames JSONB NOT NULL,
+    archived_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE queries DROP CONSTRAINT IF EXISTS queries_status_check;
+ALTER TABLE queries ADD CONSTRAINT queries_status_check
+    CHECK (status IN ('pending', 'publishing', 'published', 'processed', 'archived'));
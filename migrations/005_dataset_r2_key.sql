@@ -0,0 +1,8 @@
+-- The publisher sends each shard's R2 key, which the datasets table never stored
+ALTER TABLE datasets ADD COLUMN IF NOT EXISTS r2_key TEXT;
+
+UPDATE datasets
+SET r2_key = name || '/' || data_type || '/' || language || '/' || md5 || '.zz'
+WHERE r2_key IS NULL;
+
+ALTER TABLE datasets ALTER COLUMN r2_key SET NOT NULL;
@@ -0,0 +1,18 @@
+-- Uniform pseudo-random key per shard, derived from its checksum so it stays
+-- the same across reloads. Sampled queries walk a range of it from a seeded
+-- start, see iter_sampled_datasets. Adding it rewrites the datasets table.
+ALTER TABLE datasets ADD COLUMN IF NOT EXISTS sample_key DOUBLE PRECISION
+    GENERATED ALWAYS AS ((hashtext(md5::text)::bigint + 2147483648) / 4294967296.0) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_datasets_sample
+    ON datasets(name, language, sample_key, id);
+
+-- At most one limit, a query without any classifies the whole dataset
+ALTER TABLE queries ADD COLUMN IF NOT EXISTS sample_fraction DOUBLE PRECISION;
+ALTER TABLE queries ADD COLUMN IF NOT EXISTS sample_shards INTEGER;
+ALTER TABLE queries ADD COLUMN IF NOT EXISTS sample_bytes BIGINT;
+ALTER TABLE queries ADD COLUMN IF NOT EXISTS sample_seed INTEGER;
+
+ALTER TABLE queries DROP CONSTRAINT IF EXISTS queries_sample_check;
+ALTER TABLE queries ADD CONSTRAINT queries_sample_check
+    CHECK (num_nonnulls(sample_fraction, sample_shards, sample_bytes) <= 1);
@@ -0,0 +1,3 @@
+-- Queries that only need their first N matches are published in waves, and
+-- publishing stops once the summary reaches the target, see process_query
+ALTER TABLE queries ADD COLUMN IF NOT EXISTS match_target INTEGER;
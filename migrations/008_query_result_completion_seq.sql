@@ -0,0 +1,72 @@
+-- Results are paged and followed in completion order. Ids are assigned when a
+-- job is published, so a job with a lower id can finish after a higher id was
+-- already handed out as a cursor. Each callback instead takes the next value
+-- of its query's summary counter (last_cursor) while holding the summary row
+-- lock until commit, so per query the sequence grows in commit order.
+--
+-- Statements on query_results that are not pruned to one query lock every
+-- partition, so the backfill and the index go one query per transaction, like
+-- the copy in 003. Apply it with psql -f, outside a transaction.
+ALTER TABLE query_results ADD COLUMN IF NOT EXISTS completed_seq BIGINT;
+
+-- Created on the parent only, then per partition and attached. Partitions
+-- attached later get theirs from the parent
+CREATE INDEX IF NOT EXISTS idx_query_results_completed
+    ON ONLY query_results(query_id, completed_seq)
+    WHERE completed_seq IS NOT NULL;
+
+-- Backfill in finish order, then restart each summary's counter after it
+CREATE OR REPLACE PROCEDURE backfill_completed_seq() AS $$
+DECLARE
+    q INTEGER;
+    partition TEXT;
+    index_name TEXT;
+BEGIN
+    FOR q IN SELECT id FROM queries ORDER BY id LOOP
+        partition := format('query_results_q%s', q);
+        IF to_regclass(partition) IS NULL THEN
+            CONTINUE;
+        END IF;
+
+        -- On the partition itself, a generic plan over the parent would lock
+        -- every partition before pruning
+        EXECUTE format(
+            'UPDATE %1$I qr
+            SET completed_seq = ranked.seq
+            FROM (
+                SELECT id, ROW_NUMBER() OVER (ORDER BY finished_at, id) AS seq
+                FROM %1$I
+                WHERE finished_at IS NOT NULL
+            ) ranked
+            WHERE qr.id = ranked.id AND qr.completed_seq IS NULL',
+            partition
+        );
+
+        EXECUTE format(
+            'UPDATE query_summaries
+            SET last_cursor = (SELECT MAX(completed_seq) FROM %I)
+            WHERE query_id = $1',
+            partition
+        ) USING q;
+
+        index_name := partition || '_completed';
+        EXECUTE format(
+            'CREATE INDEX IF NOT EXISTS %I ON %I(query_id, completed_seq) WHERE completed_seq IS NOT NULL',
+            index_name, partition
+        );
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_inherits
+            WHERE inhrelid = to_regclass(index_name)
+        ) THEN
+            EXECUTE format(
+                'ALTER INDEX idx_query_results_completed ATTACH PARTITION %I', index_name
+            );
+        END IF;
+
+        COMMIT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CALL backfill_completed_seq();
+DROP PROCEDURE backfill_completed_seq();
@@ -0,0 +1,10 @@
+-- Queries whose publishing failed end in 'failed' instead of staying in
+-- 'publishing' with nothing left to move them on, see publish_query
+ALTER TABLE queries DROP CONSTRAINT IF EXISTS queries_status_check;
+ALTER TABLE queries ADD CONSTRAINT queries_status_check
+    CHECK (status IN ('pending', 'publishing', 'published', 'processed', 'archived', 'failed'));
+
+-- iter_datasets pages a dataset by id, each page is a range scan of this index.
+-- It covers the (name, language) lookups of the index it replaces
+CREATE INDEX IF NOT EXISTS idx_datasets_name_language_id ON datasets(name, language, id);
+DROP INDEX IF EXISTS idx_datasets_name_language;
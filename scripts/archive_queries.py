@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+from app.archive import (
+    ARCHIVE_CODEC,
+    archive_location,
+    remove_archive,
+    upload_archive,
+    write_archive_file,
+)
+from app.db.database import (
+    drop_query_partitions,
+    get_archivable_queries,
+    get_archive_version,
+    get_db_session,
+    get_prunable_job_queries,
+    iter_query_result_rows,
+    prune_query_jobs,
+    save_query_archive,
+)
+
+# Set up logging at the top of the file
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+def archive_query(query_id: int, finished_before: datetime):
+    """Exports a finished query's results to the archive, then prunes its rows
+
+    Skips queries get_archivable_queries would not pick, e.g. still running.
+    """
+    fd, path = tempfile.mkstemp(suffix=".ndjson.zst")
+    os.close(fd)
+    try:
+        with get_db_session() as session:
+            version = get_archive_version(session, query_id, finished_before)
+            if version is None:
+                logger.warning(f"Query {query_id} is not finished, not archiving it")
+                return
+            jobs, frames = write_archive_file(
+                path, iter_query_result_rows(session, query_id)
+            )
+        byte_size = os.path.getsize(path)
+
+        location = archive_location(query_id)
+        asyncio.run(upload_archive(path, location))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+    # Switch reads over to the archive before the rows disappear
+    try:
+        with get_db_session() as session:
+            save_query_archive(
+                session,
+                query_id,
+                version,
+                location=location,
+                codec=ARCHIVE_CODEC,
+                jobs=jobs,
+                byte_size=byte_size,
+                frames=frames,
+            )
+    except Exception:
+        # Outdated or not recorded, the next run exports the query again
+        asyncio.run(remove_archive(location))
+        raise
+    drop_query_partitions(query_id)
+    prune_query_jobs(query_id)
+
+    logger.info(
+        f"Archived query {query_id}: {jobs} jobs, {byte_size} bytes to {location}"
+    )
+
+
+def archive_queries(older_than_days: int, limit: int):
+    finished_before = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    with get_db_session() as session:
+        query_ids = get_archivable_queries(session, finished_before, limit)
+
+    logger.info(f"Found {len(query_ids)} queries to archive")
+    for query_id in query_ids:
+        try:
+            archive_query(query_id, finished_before)
+        except Exception as e:
+            logger.error(f"Error archiving query {query_id}: {str(e)}")
+
+    # Job routes left behind by deleted queries or interrupted runs
+    with get_db_session() as session:
+        leftover = get_prunable_job_queries(session)
+    for query_id in leftover:
+        pruned = prune_query_jobs(query_id)
+        logger.info(f"Pruned {pruned} job routes of query {query_id}")
+
+
+def start():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--older-than-days",
+        type=int,
+        default=30,
+        help="Archive queries whose last result arrived this many days ago",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=100, help="Maximum queries archived per run"
+    )
+    parser.add_argument("--query-id", type=int, help="Archive a single query")
+    args = parser.parse_args()
+
+    if args.query_id:
+        finished_before = datetime.now(timezone.utc) - timedelta(
+            days=args.older_than_days
+        )
+        archive_query(args.query_id, finished_before)
+        return
+
+    archive_queries(args.older_than_days, args.limit)
@@ -1,6 +1,7 @@
 import logging
 import os
 import asyncio
+import time
 import aioboto3
 from botocore.config import Config
 from typing import AsyncGenerator
@@ -8,6 +9,11 @@ from sqlalchemy.sql import text
 from datetime import date
 
 from app.db.database import get_db_session
+from app.metrics import (
+    DATASET_INSERT_DURATION,
+    DATASET_OBJECTS_LISTED,
+    DATASET_ROWS_INSERTED,
+)
 
 R2_ACCOUNT_ID = os.getenv("R2_ACCOUNT_ID")
 R2_ACCESS_KEY = os.getenv("R2_ACCESS_KEY")
@@ -44,6 +50,7 @@ async def get_object_metadata(s3_client, obj: dict) -> dict:
             "name": dataset,
             "language": language,
             "data_type": data_type,
+            "r2_key": obj["Key"],
             "md5": md5,
             "num_of_records": 0,
             "decompressed_byte_size": 0,
@@ -92,6 +99,7 @@ async def list_r2_objects(
                 valid_results = [r for r in results if r is not None]
                 processed += len(valid_results)
                 errors += len(results) - len(valid_results)
+                DATASET_OBJECTS_LISTED.inc(len(results))
 
                 logger.info(
                     f"Processed batch of {len(valid_results)} objects. Total: {processed}, Errors: {errors}"
@@ -113,22 +121,28 @@ def insert_batch_to_db(objects: list[dict]):
     """
     try:
         logger.info(f"Inserting batch of {len(objects)} records to database")
+        started = time.perf_counter()
         with get_db_session() as session:
             session.execute(
                 text(
                     """
                 INSERT INTO datasets (
-                    name, language, data_type, md5,
+                    name, language, data_type, r2_key, md5,
                     num_of_records, decompressed_byte_size, byte_size, source
                 ) VALUES (
-                    :name, :language, :data_type, :md5,
+                    :name, :language, :data_type, :r2_key, :md5,
                     :num_of_records, :decompressed_byte_size, :byte_size, :source
                 ) ON CONFLICT (md5) DO NOTHING
                 """
                 ),
                 objects,
             )
-        logger.info("Successfully inserted batch to database")
+        elapsed = time.perf_counter() - started
+        DATASET_INSERT_DURATION.observe(elapsed)
+        DATASET_ROWS_INSERTED.inc(len(objects))
+        logger.info(
+            f"Successfully inserted batch to database ({len(objects) / elapsed:.0f} rows/s)"
+        )
     except Exception as e:
         logger.error(f"Error inserting batch into database: {str(e)}")
 
@@ -140,6 +154,7 @@ async def load_dataset(dataset: str, data_type: str, offset: str = ""):
     try:
         prefix = f"{dataset}/{data_type}"
         total_processed = 0
+        started = time.perf_counter()
 
         logger.info(f"Starting dataset load for {prefix}")
 
@@ -147,7 +162,8 @@ async def load_dataset(dataset: str, data_type: str, offset: str = ""):
             if batch_metadata:
                 insert_batch_to_db(batch_metadata)
                 total_processed += len(batch_metadata)
-                logger.info(f"Total processed: {total_processed}")
+                rate = total_processed / (time.perf_counter() - started)
+                logger.info(f"Total processed: {total_processed} ({rate:.0f} objects/s)")
 
         logger.info(
             f"Completed loading dataset {prefix}. Total processed: {total_processed}"
@@ -252,8 +268,16 @@ def start():
     parser.add_argument(
         "--stats", action="store_true", help="Update dataset statistics"
     )
+    parser.add_argument(
+        "--metrics-port", type=int, help="Expose Prometheus metrics on this port"
+    )
     args = parser.parse_args()
 
+    if args.metrics_port:
+        from prometheus_client import start_http_server
+
+        start_http_server(args.metrics_port)
+
     if args.stats:
         update_dataset_stats()
         return
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import stat
+import tempfile
+
+import pytest
+
+from app import archive
+from app.archive import get_archived_query_results, write_archive_file
+
+
+def archived_rows(count: int) -> list[dict]:
+    rows = []
+    for seq in range(1, count + 1):
+        status = "error" if seq % 7 == 0 else "processed"
+        rows.append(
+            {
+                "id": count - seq,
+                "completed_seq": seq,
+                "status": status,
+                "result": [{"uri": str(seq)}] if status == "processed" else {"code": 500},
+            }
+        )
+    rows.append({"id": count, "completed_seq": None, "status": "pending", "result": None})
+    return rows
+
+
+@pytest.fixture
+def archived(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_FRAME_ROWS", 100)
+    rows = archived_rows(1000)
+    path = str(tmp_path / "query_1.ndjson.zst")
+    count, frames = write_archive_file(path, rows)
+    assert count == len(rows)
+    return path, frames, [r for r in rows if r["status"] == "processed"]
+
+
+@pytest.mark.parametrize(
+    "page, after",
+    [(1, None), (2, None), (4, None), (9, None), (1, 0), (1, 99), (1, 500), (1, 1000)],
+)
+def test_reads_pages_through_the_frame_index(archived, page, after):
+    path, frames, results = archived
+    if after is not None:
+        expected = [r for r in results if r["completed_seq"] > after]
+    else:
+        expected = results[(page - 1) * 250 :]
+
+    rows, has_more = asyncio.run(
+        get_archived_query_results(path, frames, page, page_size=250, after=after)
+    )
+    assert rows == expected[:250]
+    assert has_more == (len(expected) > 250)
+
+
+def test_indexes_frames_by_their_last_cursor(archived):
+    path, frames, results = archived
+    assert len(frames) == 11
+    assert sum(frame["results"] for frame in frames) == len(results)
+    assert [frame["last_cursor"] for frame in frames[:2]] == [100, 200]
+    assert frames[-1] == {**frames[-1], "results": 0, "last_cursor": None}
+
+
+def test_stores_local_locations_as_absolute_paths(monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_URL", "archive/")
+    assert archive.archive_location(7).startswith("/")
+    monkeypatch.setattr(archive, "ARCHIVE_URL", "s3://bucket/prefix/")
+    assert archive.archive_location(7) == "s3://bucket/prefix/query_7.ndjson.zst"
+
+
+def test_removes_local_archives_once(archived):
+    path, _, _ = archived
+    asyncio.run(archive.remove_archive(path))
+    assert not os.path.exists(path)
+    # Already gone, e.g. a retried delete
+    asyncio.run(archive.remove_archive(path))
+
+
+def test_local_archives_are_readable_by_other_users(tmp_path):
+    fd, path = tempfile.mkstemp(dir=tmp_path)
+    os.close(fd)
+    location = str(tmp_path / "archive" / "query_1.ndjson.zst")
+    asyncio.run(archive.upload_archive(path, location))
+    assert stat.S_IMODE(os.stat(location).st_mode) == 0o644
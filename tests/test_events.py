@@ -0,0 +1,238 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+
+import psycopg2
+
+from app import events
+from app.events import (
+    RESYNC,
+    SUBSCRIBER_QUEUE_SIZE,
+    QueryEventBatcher,
+    QueryEventFlusher,
+    QueryEventHub,
+    QueryEventListener,
+    merge_event,
+    stream_query_events,
+    unseen_event,
+)
+
+
+def progress(version: int, processed: int, **fields) -> dict:
+    return {
+        "query_id": 1,
+        "published": 10,
+        "processed": processed,
+        "errored": 0,
+        "matches": processed,
+        "cursor": processed,
+        "version": version,
+        **fields,
+    }
+
+
+def test_the_higher_version_keeps_its_totals_in_any_order():
+    first, second = progress(1, 1), progress(2, 2)
+    for events_in_order in ([first, second], [second, first]):
+        merged = {}
+        for event in events_in_order:
+            merge_event(merged, event)
+        assert merged == second
+
+
+def test_a_status_takes_the_latest_value_next_to_newer_totals():
+    merged = {}
+    merge_event(merged, progress(2, 2))
+    merge_event(merged, progress(1, 1, status="processed"))
+    assert merged == progress(2, 2, status="processed")
+
+    merge_event(merged, {"query_id": 1, "status": "failed"})
+    assert merged == progress(2, 2, status="failed")
+
+
+def test_unseen_event_drops_totals_a_snapshot_covers():
+    assert unseen_event(progress(3, 3), 2) == progress(3, 3)
+    assert unseen_event(progress(2, 2), 2) == {"query_id": 1}
+    assert unseen_event(progress(1, 1, status="processed"), 2) == {
+        "query_id": 1,
+        "status": "processed",
+    }
+    # Events without totals always pass
+    assert unseen_event({"query_id": 1, "status": "failed"}, 2) == {
+        "query_id": 1,
+        "status": "failed",
+    }
+
+
+def test_batcher_coalesces_per_query_until_drained():
+    batcher = QueryEventBatcher()
+    batcher.add([progress(1, 1)])
+    assert batcher.drain() == []
+
+    batcher.enabled = True
+    batcher.add([progress(1, 1), progress(3, 3)])
+    batcher.add([progress(2, 2), {**progress(1, 1), "query_id": 2}])
+    assert sorted(batcher.drain(), key=lambda e: e["query_id"]) == [
+        progress(3, 3),
+        {**progress(1, 1), "query_id": 2},
+    ]
+    assert batcher.drain() == []
+
+
+def test_a_full_queue_is_replaced_by_a_resync():
+    async def run():
+        hub = QueryEventHub()
+        queue = hub.subscribe(1)
+        other = hub.subscribe(2)
+        for version in range(SUBSCRIBER_QUEUE_SIZE + 1):
+            hub.publish(progress(version, version))
+
+        assert queue.qsize() == 1
+        assert queue.get_nowait() is RESYNC
+        assert other.empty()
+
+        # Later events queue up behind the resync again
+        hub.publish(progress(1000, 1000))
+        assert queue.get_nowait() == progress(1000, 1000)
+
+    asyncio.run(run())
+
+
+def test_resync_all_reaches_every_subscriber():
+    async def run():
+        hub = QueryEventHub()
+        queues = [hub.subscribe(1), hub.subscribe(1), hub.subscribe(2)]
+        hub.resync_all()
+        assert [q.get_nowait() for q in queues] == [RESYNC] * 3
+
+        for queue in queues[:2]:
+            hub.unsubscribe(1, queue)
+        hub.publish(progress(1, 1))
+        assert all(q.empty() for q in queues)
+
+    asyncio.run(run())
+
+
+class StubRequest:
+    def __init__(self, checks: int):
+        self.remaining = checks
+
+    async def is_disconnected(self) -> bool:
+        self.remaining -= 1
+        return self.remaining < 0
+
+
+def test_stream_skips_progress_its_snapshot_covers(monkeypatch):
+    hub = QueryEventHub()
+    monkeypatch.setattr(events, "query_event_hub", hub)
+    snapshots = iter([progress(2, 2), progress(5, 5)])
+
+    async def run() -> list[str]:
+        stream = stream_query_events(StubRequest(5), 1, lambda: next(snapshots))
+        messages = [await stream.__anext__()]
+        # Committed before the snapshot, flushed after it
+        hub.publish(progress(1, 1))
+        hub.publish(progress(2, 2, status="processed"))
+        hub.publish(progress(3, 3))
+        hub.resync_all()
+        hub.publish(progress(4, 4))
+        messages += [message async for message in stream]
+        return messages
+
+    messages = [m.split("\n")[:2] for m in asyncio.run(run())]
+    assert [(m[0], json.loads(m[1][len("data: "):])) for m in messages] == [
+        ("event: snapshot", progress(2, 2)),
+        ("event: progress", {"query_id": 1, "status": "processed"}),
+        ("event: progress", progress(3, 3)),
+        ("event: snapshot", progress(5, 5)),
+    ]
+
+
+class StubFlusher(QueryEventFlusher):
+    def __init__(self, batcher: QueryEventBatcher, fail: bool = False):
+        super().__init__("postgresql://localhost/mizu", batcher)
+        self.fail = fail
+        self.sent = []
+        self.running = 0
+        self.overlapped = False
+        self._guard = threading.Lock()
+
+    def _notify(self, events: list[dict]):
+        with self._guard:
+            self.running += 1
+            self.overlapped |= self.running > 1
+        time.sleep(0.1)
+        with self._guard:
+            self.running -= 1
+        if self.fail:
+            raise psycopg2.OperationalError("connection lost")
+        self.sent.append(events)
+
+
+def test_stop_waits_for_a_flush_in_progress(monkeypatch):
+    monkeypatch.setattr(events, "QUERY_EVENT_FLUSH_SECONDS", 0.01)
+
+    async def run() -> StubFlusher:
+        batcher = QueryEventBatcher()
+        flusher = StubFlusher(batcher)
+        await flusher.start()
+        batcher.add([progress(1, 1)])
+        # The periodic flush is now sending from its thread
+        await asyncio.sleep(0.05)
+        batcher.add([progress(2, 2)])
+        await flusher.stop()
+        assert not batcher.enabled
+        return flusher
+
+    flusher = asyncio.run(run())
+    assert not flusher.overlapped
+    assert flusher.sent == [[progress(1, 1)], [progress(2, 2)]]
+
+
+def test_failed_flushes_are_retried_merged_with_newer_events():
+    async def run():
+        batcher = QueryEventBatcher()
+        batcher.enabled = True
+        flusher = StubFlusher(batcher, fail=True)
+        batcher.add([progress(2, 2)])
+        await flusher.flush()
+        batcher.add([progress(1, 1)])
+        assert batcher.drain() == [progress(2, 2)]
+
+    asyncio.run(run())
+
+
+class StubListener(QueryEventListener):
+    def __init__(self, hub: QueryEventHub, failures: int):
+        super().__init__("postgresql://localhost/mizu", hub)
+        self.failures = failures
+        self.threads = set()
+        self.sockets = socket.socketpair()
+
+    def _connect(self):
+        self.threads.add(threading.get_ident())
+        if self.failures:
+            self.failures -= 1
+            raise psycopg2.OperationalError("database is starting up")
+        return self.sockets[0]
+
+
+def test_reconnects_off_the_event_loop_and_resyncs(monkeypatch):
+    monkeypatch.setattr(events, "RECONNECT_SECONDS", 0.01)
+
+    async def run() -> StubListener:
+        hub = QueryEventHub()
+        queue = hub.subscribe(1)
+        listener = StubListener(hub, failures=2)
+        await listener._reconnect()
+        assert queue.get_nowait() is RESYNC
+        asyncio.get_running_loop().remove_reader(listener.sockets[0].fileno())
+        return listener
+
+    listener = asyncio.run(run())
+    assert listener.failures == 0
+    assert threading.get_ident() not in listener.threads
+    for sock in listener.sockets:
+        sock.close()
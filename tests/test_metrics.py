@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from app.metrics import MetricsMiddleware
+
+
+def requests_recorded(route: str, status: str) -> float:
+    return REGISTRY.get_sample_value(
+        "http_request_duration_seconds_count",
+        {"method": "GET", "route": route, "status": status},
+    ) or 0
+
+
+def call(app, route: str):
+    scope = {"type": "http", "method": "GET", "route": type("Route", (), {"path": route})}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(MetricsMiddleware(app)(scope, receive, send))
+    return sent
+
+
+def test_records_the_response_status():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 404, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    before = requests_recorded("/test/found", "404")
+    call(app, "/test/found")
+    assert requests_recorded("/test/found", "404") == before + 1
+
+
+def test_records_a_500_when_the_app_raises():
+    async def app(scope, receive, send):
+        raise RuntimeError("boom")
+
+    before = requests_recorded("/test/raises", "500")
+    with pytest.raises(RuntimeError):
+        call(app, "/test/raises")
+    assert requests_recorded("/test/raises", "500") == before + 1
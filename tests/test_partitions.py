@@ -0,0 +1,102 @@
+"""query_results and query_result_entries have one partition per query. A
+statement Postgres cannot prune to one partition locks all of them, with
+their indexes and TOAST tables, and runs out of lock slots once there are a
+few thousand queries, see migrations/003_partition_query_results.sql."""
+
+import ast
+import pathlib
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+SOURCES = sorted(
+    path
+    for package in ("app", "scripts", "benchmarks")
+    for path in (ROOT / package).rglob("*.py")
+)
+
+PARTITIONED_MODELS = {"QueryResult", "QueryResultEntry"}
+# Inserts route rows to one partition, everything else reads or changes them
+STATEMENTS = {"query", "select", "update", "delete"}
+
+
+def called_name(call: ast.Call) -> str:
+    func = call.func
+    return func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", "")
+
+
+def models_in(nodes) -> set[str]:
+    return {
+        node.id
+        for root in nodes
+        for node in ast.walk(root)
+        if isinstance(node, ast.Name) and node.id in PARTITIONED_MODELS
+    }
+
+
+def filtered_models(node: ast.AST) -> set[str]:
+    """Models compared on query_id with == anywhere in the expression"""
+    return {
+        compare.left.value.id
+        for compare in ast.walk(node)
+        if isinstance(compare, ast.Compare)
+        and isinstance(compare.ops[0], ast.Eq)
+        and isinstance(compare.left, ast.Attribute)
+        and compare.left.attr == "query_id"
+        and isinstance(compare.left.value, ast.Name)
+    }
+
+
+def outermost_chain(node: ast.AST, parents: dict) -> ast.AST:
+    """The whole `session.query(...).filter(...)...` chain a call starts"""
+    while True:
+        parent = parents.get(node)
+        if isinstance(parent, ast.Attribute) and parent.value is node:
+            node = parent
+        elif isinstance(parent, ast.Call) and parent.func is node:
+            node = parent
+        else:
+            return node
+
+
+def unpruned_statements(path: pathlib.Path) -> list[str]:
+    tree = ast.parse(path.read_text())
+    parents = {
+        child: parent for parent in ast.walk(tree) for child in ast.iter_child_nodes(parent)
+    }
+    problems = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and node.attr in ("any", "has"):
+            # Correlated EXISTS over every partition
+            if isinstance(node.value, ast.Attribute) and node.value.attr == "results":
+                problems.append((node.lineno, f"Query.results.{node.attr}()"))
+            continue
+        if not isinstance(node, ast.Call) or called_name(node) not in STATEMENTS:
+            continue
+        models = models_in(node.args)
+        missing = models - filtered_models(outermost_chain(node, parents))
+        if missing:
+            problems.append(
+                (node.lineno, f"{', '.join(sorted(missing))} without query_id ==")
+            )
+    return [f"{path.name}:{line} {problem}" for line, problem in sorted(problems)]
+
+
+@pytest.mark.parametrize("path", SOURCES, ids=lambda p: str(p.relative_to(ROOT)))
+def test_partitioned_tables_are_filtered_by_query(path):
+    assert unpruned_statements(path) == []
+
+
+def test_flags_statements_that_scan_every_partition(tmp_path):
+    source = tmp_path / "routes.py"
+    source.write_text(
+        "session.query(QueryResult).filter(QueryResult.status == 'error').count()\n"
+        "session.query(Query).filter(or_(Query.status == 'x', Query.results.any()))\n"
+        "select(QueryResultEntry.id).where(QueryResultEntry.query_id.in_(ids))\n"
+        "session.query(QueryResult).filter(QueryResult.query_id == query_id).all()\n"
+    )
+    assert unpruned_statements(source) == [
+        "routes.py:1 QueryResult without query_id ==",
+        "routes.py:2 Query.results.any()",
+        "routes.py:3 QueryResultEntry without query_id ==",
+    ]
@@ -0,0 +1,28 @@
+import asyncio
+import time
+
+from app import profiling
+from app.profiling import TaskSampler, run_in_thread
+
+
+def slow_work():
+    deadline = time.perf_counter() + 0.2
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_samples_threads_doing_a_profiled_tasks_work():
+    async def request():
+        sampler = TaskSampler(asyncio.current_task(), 0.005)
+        profiling._sampler.set(sampler)
+        sampler.start()
+        await run_in_thread(slow_work)
+        sampler.stop()
+        return sampler
+
+    sampler = asyncio.run(request())
+    assert any("slow_work" in stack for stack in sampler.stacks)
+
+
+def test_runs_unprofiled_work_in_a_thread():
+    assert asyncio.run(run_in_thread(sum, [1, 2, 3])) == 6
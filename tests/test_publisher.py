@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app import publisher
+from app.models.dataset import Dataset
+from app.models.query import Query
+from app.models.service import QuerySample
+from app.publisher import (
+    BATCH_SIZE,
+    PUBLISH_WAVE_MAX,
+    iter_sampled_datasets,
+    next_wave_size,
+)
+
+
+def test_doubles_until_the_first_matches():
+    assert next_wave_size(100, 5000, 5000, 0, 5000) == 10000
+    assert next_wave_size(100, 5000, 0, 0, 5000) == 10000
+
+
+def test_sizes_from_the_match_rate_with_a_margin():
+    # 1% match rate, 90 missing matches
+    assert next_wave_size(100, 1000, 1000, 10, 1000) == 11250
+
+
+def test_counts_running_jobs_towards_the_target():
+    # 1000 jobs still running are expected to bring 10 more matches
+    assert next_wave_size(100, 2000, 1000, 10, 1000) == 10000
+
+
+def test_waits_when_running_jobs_cover_the_target():
+    assert next_wave_size(100, 20000, 1000, 10, 1000) == 0
+    # Exactly covered
+    assert next_wave_size(100, 10000, 1000, 10, 1000) == 0
+
+
+def test_clamps_to_the_batch_size_and_the_wave_maximum():
+    assert next_wave_size(11, 10, 10, 10, 10) == BATCH_SIZE
+    assert next_wave_size(10**9, 1000, 1000, 1, 1000) == PUBLISH_WAVE_MAX
+    assert next_wave_size(100, 0, 0, 0, PUBLISH_WAVE_MAX) == PUBLISH_WAVE_MAX
+
+
+# Twenty shards spread over the sample_key circle, 0.01, 0.06, ..., 0.96
+SAMPLE_KEYS = [round((i + 0.2) / 20, 2) for i in range(20)]
+
+
+class StubSession:
+    """Runs the publisher's statements on SQLite, in place of an AsyncSession"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    async def execute(self, stmt):
+        return self.session.execute(stmt)
+
+
+@pytest.fixture
+def datasets(monkeypatch):
+    monkeypatch.setattr(publisher, "BATCH_SIZE", 3)
+    engine = create_engine("sqlite://")
+    columns = ", ".join(
+        f"{c.name} INTEGER PRIMARY KEY" if c.primary_key else c.name
+        for c in Dataset.__table__.columns
+    )
+    with Session(engine) as session:
+        # sample_key is computed by Postgres, written directly here
+        session.execute(text(f"CREATE TABLE datasets ({columns})"))
+        session.execute(
+            text(
+                "INSERT INTO datasets (name, language, data_type, r2_key, md5, byte_size, sample_key)"
+                " VALUES (:name, :language, 'text', :key, :key, :byte_size, :sample_key)"
+            ),
+            [
+                {
+                    "name": "ds",
+                    "language": language,
+                    "key": f"{language}-{sample_key}",
+                    "byte_size": 10,
+                    "sample_key": sample_key,
+                }
+                for sample_key in SAMPLE_KEYS
+                for language in ("en", "fr")
+            ],
+        )
+        yield StubSession(session)
+
+
+def sample(datasets, monkeypatch, start: float, **limits) -> list[list[float]]:
+    monkeypatch.setattr(publisher, "sample_start", lambda seed: start)
+
+    async def collect():
+        query = Query(dataset="ds", language="en", query_text="q", **limits)
+        return [
+            [dataset.sample_key for dataset in batch]
+            async for batch in iter_sampled_datasets(datasets, query)
+        ]
+
+    return asyncio.run(collect())
+
+
+def test_a_fraction_wraps_around_the_circle(datasets, monkeypatch):
+    assert sample(datasets, monkeypatch, 0.8, sample_fraction=0.3) == [
+        [0.81, 0.86, 0.91],
+        [0.96],
+        [0.01, 0.06],
+    ]
+
+
+def test_a_fraction_from_the_start_covers_its_arc_only(datasets, monkeypatch):
+    assert sample(datasets, monkeypatch, 0.0, sample_fraction=0.25) == [
+        [0.01, 0.06, 0.11],
+        [0.16, 0.21],
+    ]
+
+
+def test_stops_at_the_shard_count_across_the_wrap(datasets, monkeypatch):
+    assert sample(datasets, monkeypatch, 0.9, sample_shards=5) == [
+        [0.91, 0.96],
+        [0.01, 0.06, 0.11],
+    ]
+
+
+def test_stops_at_the_first_shard_over_the_byte_budget(datasets, monkeypatch):
+    assert sample(datasets, monkeypatch, 0.9, sample_bytes=35) == [[0.91, 0.96], [0.01]]
+
+
+def test_a_budget_of_every_shard_takes_the_whole_circle(datasets, monkeypatch):
+    batches = sample(datasets, monkeypatch, 0.5, sample_bytes=10 * len(SAMPLE_KEYS))
+    keys = [key for batch in batches for key in batch]
+    assert keys == SAMPLE_KEYS[10:] + SAMPLE_KEYS[:10]
+
+
+def test_an_empty_sample_is_an_error(datasets, monkeypatch):
+    # Falls between 0.46 and 0.51
+    with pytest.raises(ValueError):
+        sample(datasets, monkeypatch, 0.47, sample_fraction=0.03)
+
+
+def test_samples_differ_by_seed_and_repeat_per_seed():
+    assert publisher.sample_start(1) == publisher.sample_start(1)
+    assert publisher.sample_start(1) != publisher.sample_start(2)
+    assert 0 <= publisher.sample_start(2**31 - 1) < 1
+
+
+@pytest.mark.parametrize(
+    "limits",
+    [{}, {"fraction": 0.1, "shards": 10}, {"shards": 10, "maxBytes": 1000}],
+)
+def test_a_sample_sets_exactly_one_limit(limits):
+    with pytest.raises(ValidationError):
+        QuerySample(**limits)
+
+
+def test_a_sample_takes_any_single_limit():
+    assert QuerySample(fraction=0.5).fraction == 0.5
+    assert QuerySample(shards=3, seed=7).seed == 7
+    assert QuerySample(maxBytes=1000).max_bytes == 1000
@@ -0,0 +1,145 @@
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.db import database
+from app.db.database import get_read_db_session
+from app.models import Query, QuerySummary
+
+
+def read_sessions(target: str, reason: str) -> float:
+    return REGISTRY.get_sample_value(
+        "db_read_sessions_total", {"target": target, "reason": reason}
+    ) or 0
+
+
+def sqlite_engine():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Query.metadata.create_all(engine, tables=[Query.__table__, QuerySummary.__table__])
+    return engine
+
+
+@pytest.fixture
+def engines(monkeypatch):
+    """A primary and a replica, get_read_db_session picks one of them"""
+    primary, replica = sqlite_engine(), sqlite_engine()
+    monkeypatch.setattr(database, "engine", primary)
+    monkeypatch.setattr(database, "replica_engine", replica)
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(bind=primary))
+    monkeypatch.setattr(database, "ReplicaSessionLocal", sessionmaker(bind=replica))
+    monkeypatch.setattr(database, "REPLICA_MAX_LAG_SECONDS", 5.0)
+    lag = {"seconds": 0.0}
+
+    def replica_lag(session: Session) -> float:
+        if isinstance(lag["seconds"], Exception):
+            raise lag["seconds"]
+        return lag["seconds"]
+
+    monkeypatch.setattr(database, "replica_lag", replica_lag)
+    return primary, replica, lag
+
+
+def add_query(engine, status: str, published: int = 10, finished: int = 10) -> int:
+    with Session(engine) as session:
+        query = Query(
+            query_text="q", dataset="d", language="en", model="m", owner="o", status=status
+        )
+        session.add(query)
+        session.flush()
+        session.add(
+            QuerySummary(
+                query_id=query.id,
+                published=published,
+                processed=finished,
+                errored=0,
+                matches=0,
+                version=1,
+            )
+        )
+        session.commit()
+        return query.id
+
+
+def routed(query_id: int = None, settled: bool = False):
+    with get_read_db_session(query_id, settled=settled) as session:
+        return session.get_bind()
+
+
+def test_reads_from_a_fresh_replica(engines):
+    _, replica, _ = engines
+    before = read_sessions("replica", "fresh")
+    assert routed() is replica
+    assert read_sessions("replica", "fresh") == before + 1
+
+
+@pytest.mark.parametrize(
+    "lag, reason",
+    [
+        (5.5, "lagging"),
+        # Nothing replayed since it started
+        (None, "lagging"),
+        (OperationalError("SELECT", {}, Exception("connection refused")), "unavailable"),
+    ],
+)
+def test_falls_back_to_the_primary(engines, lag, reason):
+    primary, _, replica_lag = engines
+    replica_lag["seconds"] = lag
+    before = read_sessions("primary", reason)
+    assert routed() is primary
+    assert read_sessions("primary", reason) == before + 1
+
+
+def test_a_replica_within_the_lag_limit_serves(engines):
+    _, replica, replica_lag = engines
+    replica_lag["seconds"] = 5.0
+    assert routed() is replica
+
+
+def test_a_replica_without_a_streaming_wal_receiver_falls_back(engines):
+    # replica_lag then reports the age of the last replayed transaction, even
+    # though everything received was replayed
+    primary, _, replica_lag = engines
+    replica_lag["seconds"] = 60.0
+    assert routed() is primary
+
+
+def test_queries_the_replica_has_not_seen_go_to_the_primary(engines):
+    primary, replica, _ = engines
+    query_id = add_query(primary, "published")
+    assert routed(query_id) is primary
+
+    add_query(replica, "published")
+    assert routed(query_id) is replica
+
+
+@pytest.mark.parametrize(
+    "status, finished, target",
+    [
+        ("publishing", 10, "primary"),
+        ("published", 9, "primary"),
+        ("published", 10, "replica"),
+        ("processed", 10, "replica"),
+        # Served from the archive, nothing moves any more
+        ("archived", 0, "replica"),
+    ],
+)
+def test_settled_reads_wait_for_the_results_to_settle(engines, status, finished, target):
+    primary, replica, _ = engines
+    add_query(primary, status, finished=finished)
+    query_id = add_query(replica, status, finished=finished)
+    assert routed(query_id, settled=True) is {"primary": primary, "replica": replica}[target]
+    # Without settled, a query the replica has seen is read from it
+    assert routed(query_id) is replica
+
+
+def test_without_a_replica_reads_go_to_the_primary(engines, monkeypatch):
+    primary, _, _ = engines
+    monkeypatch.setattr(database, "replica_engine", None)
+    before = read_sessions("primary", "no_replica")
+    assert routed(1) is primary
+    assert read_sessions("primary", "no_replica") == before + 1
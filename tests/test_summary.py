@@ -0,0 +1,48 @@
+from sqlalchemy.dialects import postgresql
+
+from app.db.summary import FACET_HOST, query_facets_upsert, uri_host
+
+
+def facet_rows(stmt) -> set:
+    params = stmt.compile(dialect=postgresql.dialect()).params
+    rows = set()
+    i = 0
+    while f"facet_m{i}" in params:
+        rows.add((params[f"facet_m{i}"], params[f"value_m{i}"], params[f"count_m{i}"]))
+        i += 1
+    return rows
+
+
+def test_uri_host():
+    assert uri_host("https://Host.Example:8080/page") == "host.example"
+    assert uri_host("not a uri") == ""
+    assert uri_host("http://[bad/") == ""
+
+
+def test_malformed_uris_count_under_an_empty_host():
+    stmt = query_facets_upsert(
+        1,
+        [
+            {"uri": "http://[bad/", "text": "a"},
+            {"uri": "https://host.example/a", "text": "b"},
+            {"uri": "https://host.example/b", "text": "c"},
+            {"text": "no uri"},
+        ],
+    )
+    assert facet_rows(stmt) == {
+        (FACET_HOST, "", 2),
+        (FACET_HOST, "host.example", 2),
+    }
+
+
+def test_jobs_without_entries_contribute_nothing():
+    assert query_facets_upsert(1, []) is None
+
+
+def test_a_retry_moves_the_error_code_count():
+    stmt = query_facets_upsert(1, [], {"code": 503}, replaced_error={"code": 500})
+    assert facet_rows(stmt) == {("error_code", "503", 1), ("error_code", "500", -1)}
+
+
+def test_a_retry_with_the_same_error_changes_nothing():
+    assert query_facets_upsert(1, [], {"code": 500}, replaced_error={"code": 500}) is None
@@ -0,0 +1,88 @@
+import json
+
+import msgpack
+import pytest
+import zstandard
+from fastapi import HTTPException
+
+from app import wire
+from app.wire import decode_job_result, encode_job_result
+
+RESULT = {
+    "jobId": "job-1",
+    "batchClassifyResult": [
+        {"uri": "https://host.example/a", "text": "first"},
+        {"uri": "https://host.example/b", "text": "second"},
+    ],
+}
+
+
+def status_of(body: bytes, content_type: str = "", content_encoding: str = "") -> int:
+    with pytest.raises(HTTPException) as e:
+        decode_job_result(body, content_type, content_encoding)
+    return e.value.status_code
+
+
+@pytest.mark.parametrize("encoding", ["json", "json+zstd", "msgpack", "msgpack+zstd"])
+def test_round_trips_every_encoding(encoding):
+    body, headers = encode_job_result(RESULT, encoding)
+    result = decode_job_result(
+        body, headers["Content-Type"], headers.get("Content-Encoding", "")
+    )
+    assert result == RESULT
+
+
+def test_json_is_the_default_and_parameters_are_ignored():
+    body = json.dumps(RESULT).encode()
+    assert decode_job_result(body) == RESULT
+    assert decode_job_result(body, "application/json; charset=utf-8") == RESULT
+
+
+def test_error_results_and_unknown_keys():
+    body = msgpack.packb(
+        {"jobId": "job-2", "errorResult": {"code": 503}, "extra": True}
+    )
+    assert decode_job_result(body, "application/msgpack") == {
+        "jobId": "job-2",
+        "errorResult": {"code": 503},
+    }
+
+
+def test_reads_every_zstd_frame():
+    raw = json.dumps(RESULT).encode()
+    compressor = zstandard.ZstdCompressor()
+    body = compressor.compress(raw[:10]) + compressor.compress(raw[10:])
+    assert decode_job_result(body, "application/json", "zstd") == RESULT
+
+
+def test_rejects_trailing_garbage_after_a_zstd_frame():
+    body = zstandard.ZstdCompressor().compress(json.dumps(RESULT).encode())
+    assert status_of(body + b"not a zstd frame", "application/json", "zstd") == 400
+
+
+def test_rejects_decompressed_bodies_over_the_limit(monkeypatch):
+    monkeypatch.setattr(wire, "MAX_CALLBACK_BYTES", 1024)
+    monkeypatch.setattr(wire, "ZSTD_READ_SIZE", 100)
+    body, headers = encode_job_result(
+        {"jobId": "job-3", "batchClassifyResult": [{"uri": "u", "text": "x" * 4096}]},
+        "json+zstd",
+    )
+    assert status_of(body, headers["Content-Type"], "zstd") == 413
+
+
+def test_rejects_unsupported_content_types_and_encodings():
+    assert status_of(b"jobId=1", "application/x-www-form-urlencoded") == 415
+    assert status_of(json.dumps(RESULT).encode(), "application/json", "gzip") == 415
+
+
+def test_rejects_malformed_bodies():
+    assert status_of(b"\xc1", "application/msgpack") == 400
+    assert status_of(b"not zstd", "application/json", "zstd") == 400
+    assert status_of(b"{", "application/json") == 422
+
+
+def test_rejects_invalid_payloads():
+    assert status_of(msgpack.packb({"jobId": 1}), "application/msgpack") == 422
+    assert status_of(json.dumps({"batchClassifyResult": []}).encode()) == 422
+    body = json.dumps({"jobId": "job-4", "batchClassifyResult": [{"uri": "u"}]})
+    assert status_of(body.encode()) == 422